@@ -0,0 +1,150 @@
+__author__ = 'jaya'
+
+# Local imports
+from log import create_logger
+
+# Setup logger
+logger = create_logger(__name__)
+
+# Set logging level
+DEBUG = 10
+NOTSET = 0
+logger.setLevel(NOTSET)
+
+# Bump when analysis output changes, so cached results are recomputed
+ANALYSIS_VERSION = 2
+PROGRAM_START = 0x200
+# XO-CHIP F000 NNNN (LD I, long addr) is followed by a 16 bit address operand
+LONG_OPCODE = 0xF000
+
+def instruction_size(opcode):
+    """
+    Size of instruction in bytes, including operands.
+    :param opcode: 2 byte opcode
+    :return: 4 for XO-CHIP F000 NNNN, else 2
+    """
+    return 4 if opcode == LONG_OPCODE else 2
+
+def successors(address, opcode, next_opcode=None):
+    """
+    Find addresses that can execute after given instruction.
+    :param address: address of instruction
+    :param opcode: 2 byte opcode
+    :param next_opcode: opcode at address + 2, skip instructions skip all of F000 NNNN
+    :return: tuple (list of successor addresses, True if instruction ends a basic block)
+    """
+    lookup_opcode = opcode >> 12
+    kk = opcode & 0x00ff
+    nnn = opcode & 0x0fff
+    if opcode == 0x00EE:  # RET
+        return [], True
+    if lookup_opcode == 0x1:  # JP addr
+        return [nnn], True
+    if lookup_opcode == 0x2:  # CALL addr, returns to next instruction
+        return [nnn, address + 2], True
+    if lookup_opcode == 0xB:  # JP V0, addr - target is not known statically
+        return [], True
+    if lookup_opcode in (0x3, 0x4, 0x5, 0x9) or (lookup_opcode == 0xE and kk in (0x9E, 0xA1)):
+        return [address + 2, address + 2 + instruction_size(next_opcode)], True
+    return [address + instruction_size(opcode)], False
+
+
+class BasicBlock(object):
+    def __init__(self, start, end, successors):
+        """
+        Straight line code from start up to (not including) end.
+        :param start: address of first instruction
+        :param end: address after last instruction
+        :param successors: start addresses of blocks that can follow
+        """
+        self.start = start
+        self.end = end
+        self.successors = successors
+
+
+class ProgramAnalysis(object):
+    def __init__(self, instructions, blocks, computed_jumps):
+        """
+        Result of static analysis of a program.
+        :param instructions: dict of address -> opcode for instructions reachable from PROGRAM_START
+        :param blocks: dict of start address -> BasicBlock (control flow graph)
+        :param computed_jumps: addresses of Bnnn instructions, whose targets are not known
+        """
+        self.instructions = instructions
+        self.blocks = blocks
+        self.computed_jumps = computed_jumps
+
+    def to_dict(self):
+        """
+        Convert to JSON serializable dictionary
+        :return: dict
+        """
+        return {
+            'version': ANALYSIS_VERSION,
+            'instructions': sorted(self.instructions.items()),
+            'blocks': [[block.start, block.end, block.successors] for _, block in sorted(self.blocks.items())],
+            'computed_jumps': self.computed_jumps
+        }
+
+    @staticmethod
+    def from_dict(data):
+        """
+        Create analysis from dictionary made by to_dict
+        :param data: dict
+        :return: ProgramAnalysis or None if data was made by another analysis version
+        """
+        if data.get('version') != ANALYSIS_VERSION:
+            return None
+        instructions = dict((address, opcode) for address, opcode in data['instructions'])
+        blocks = dict((start, BasicBlock(start, end, successors)) for start, end, successors in data['blocks'])
+        return ProgramAnalysis(instructions, blocks, data['computed_jumps'])
+
+
+def analyze_program(program):
+    """
+    Decode every instruction reachable from PROGRAM_START and build control flow graph.
+    Jumps outside the program are not followed.
+    :param program: ROM contents
+    :return: ProgramAnalysis
+    """
+    end = PROGRAM_START + len(program)
+    instructions = dict()
+    block_ends = dict()  # address -> successors, for instructions ending a block
+    leaders = set([PROGRAM_START])
+    computed_jumps = list()
+    pending = [PROGRAM_START]
+    while pending:
+        address = pending.pop()
+        if address in instructions or address < PROGRAM_START or address + 1 >= end:
+            continue
+        offset = address - PROGRAM_START
+        opcode = (program[offset] << 8) | program[offset + 1]
+        next_opcode = (program[offset + 2] << 8) | program[offset + 3] if address + 3 < end else None
+        instructions[address] = opcode
+        next_addresses, ends_block = successors(address, opcode, next_opcode)
+        if (opcode >> 12) == 0xB:
+            computed_jumps.append(address)
+        if ends_block:
+            block_ends[address] = next_addresses
+            leaders.update(next_addresses)
+        pending.extend(next_addresses)
+
+    blocks = dict()
+    for start in sorted(leaders):
+        if start not in instructions:
+            continue
+        address = start
+        while True:
+            if address in block_ends:
+                successor_list = [target for target in block_ends[address] if target in instructions]
+                blocks[start] = BasicBlock(start, address + 2, successor_list)
+                break
+            address += instruction_size(instructions[address])
+            if address not in instructions:
+                blocks[start] = BasicBlock(start, address, [])
+                break
+            if address in leaders:
+                blocks[start] = BasicBlock(start, address, [address])
+                break
+    logger.debug("Found {} instructions in {} blocks".format(len(instructions), len(blocks)))
+    return ProgramAnalysis(instructions, blocks, sorted(computed_jumps))
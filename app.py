@@ -1,13 +1,16 @@
 __author__ = "jaya"
 
 # External imports
-import pygame
-import sys
+import time
+APP_START_TIME = time.perf_counter()
+import argparse
 
 # local imports
 from log import create_logger
 from display import Chip8Screen
-from cpu import CPU
+from cpu import CPU, ENGINES
+from rom_database import RomDatabase
+from frame_skip import FrameSkipper, DEFAULT_MAX_SKIP
 
 # set up logger
 logger = create_logger(__name__)
@@ -17,45 +20,270 @@ DEBUG = 10
 NOTSET = 0
 logger.setLevel(NOTSET)
 
-def main_loop(binary):
-    # initialize pygame display
+# pygame - window, sound and keyboard. console - prints frames to terminal.
+# headless - no output at all. Only pygame backend imports pygame.
+BACKENDS = ('pygame', 'console', 'headless')
+FRAME_TIME = 1 / 60
+
+def create_cpu(binary, backend='pygame'):
+    """
+    Create display for given backend and CPU attached to it.
+    :param binary: path to ROM
+    :param backend: one of BACKENDS
+    :return: CPU object. Binary is not loaded yet.
+    """
     ch8_screen = Chip8Screen(scale=10)
-    ch8_screen.initialize_display()
+    if backend == 'pygame':
+        # initialize pygame display
+        ch8_screen.initialize_display()
+        sound = 'pong.wav'
+    else:
+        sound = None
 
     # initialize registers and memory
-    cpu = CPU(binary=binary, screen=ch8_screen, sound='pong.wav')
+    return CPU(binary=binary, screen=ch8_screen, sound=sound)
 
-    # Load and validate binary. set PC.
-    cpu.initialize_cpu()
+def handle_pygame_events(cpu, telemetry=None):
+    """
+    Process pygame keyboard, window and file drop events.
+    :param cpu: CPU object
+    :param telemetry: Telemetry object told about key presses, or None
+    :return: path of ROM to load if a ROM file was dropped on the window or F5
+             was pressed to restart current ROM, else None
+    """
+    import pygame
+    rom = None
+    for event in pygame.event.get():
+        if event.type == pygame.KEYDOWN or event.type == pygame.KEYUP:
+            if event.key == pygame.K_F5 and event.type == pygame.KEYDOWN:
+                rom = cpu.binary_file
+                continue
+            ascii_key = event.key
+            cpu.update_keys_pressed(ascii_key, event.type == pygame.KEYDOWN)
+            if telemetry and event.type == pygame.KEYDOWN and ascii_key in cpu.keyboard_mapping:
+                telemetry.key_pressed()
+        elif event.type == pygame.DROPFILE:
+            rom = event.file
+        elif event.type == pygame.QUIT:
+            cpu.is_running = False
+            cpu.destroy_display()
+    return rom
 
-    # game loop
-    while cpu.is_running:
-        # execute one instruction and increment PC
-        cpu.execute_one_instruction()
+def load_rom(cpu, database, binary, instructions_per_frame=None, shift_Vy=None):
+    """
+    Apply ROM database settings for binary, then command line overrides, and (re)load it.
+    Window, sound and engine of the CPU are reused. Binary is validated first, so the CPU
+    is unchanged if it raises.
+    :param cpu: CPU object
+    :param database: RomDatabase object
+    :param binary: path to ROM
+    :param instructions_per_frame: overrides database value if not None
+    :param shift_Vy: overrides database quirk if not None
+    :return: number of instructions to execute per frame
+    """
+    cpu.validate_binary(binary)
+    settings = database.configure_cpu(cpu, binary)
+    if shift_Vy is not None:
+        cpu.shift_Vy = shift_Vy
+    cpu.reset(binary)
+    return instructions_per_frame or settings.instructions_per_frame
 
-        # print debug data
-        logger.debug(cpu.get_debug_data())
+def main_loop(binary, backend='pygame', engine='reference', instructions_per_frame=None, shift_Vy=None,
+              shared_memory_name=None, capture_path=None, capture_scale=4, metrics_file=None, metrics_port=None,
+              telemetry_overlay=False, max_frame_skip=DEFAULT_MAX_SKIP):
+    cpu = create_cpu(binary, backend)
+    cpu.realtime_timers = False
+    cpu.set_engine(engine)
 
-        # update display if required
-        if cpu.screen.needs_screen_update:
-            cpu.screen.draw_frame()
+    # Load and validate binary with known settings for it. set PC.
+    database = RomDatabase()
+    frame_instructions = load_rom(cpu, database, binary, instructions_per_frame, shift_Vy)
 
-        # Check for keyboard events
-        for event in pygame.event.get():
-            if event.type == pygame.KEYDOWN or event.type == pygame.KEYUP:
-                ascii_key = event.key
-                cpu.update_keys_pressed(ascii_key, event.type)
-            if event.type == pygame.QUIT:
-                cpu.is_running = False
-                cpu.destroy_display()
+    if backend == 'pygame':
+        draw_frame = cpu.screen.draw_frame
+    elif backend == 'console':
+        draw_frame = cpu.screen.draw_frame_to_console
+    else:
+        draw_frame = cpu.screen.mark_frame_drawn
 
-        # For smooth frame rates
-        pygame.time.wait(1)
+    # skip drawing frames when rendering can not keep up. Emulation is never skipped.
+    frame_skipper = None
+    if backend != 'headless' and max_frame_skip > 0:
+        frame_skipper = FrameSkipper(max_frame_skip)
 
-if __name__ == '__main__':
-    if len(sys.argv) == 2:
-        main_loop(binary=sys.argv[1])
-    else:
-        print("USAGE: app.py <ROM_PATH>")
+    # publish state to shared memory for out-of-process consumers
+    publisher = None
+    if shared_memory_name:
+        from shared_state import SharedStatePublisher
+        publisher = SharedStatePublisher(name=shared_memory_name, width=cpu.screen.width, height=cpu.screen.height)
+
+    # record frames straight from display buffer
+    recorder = None
+    if capture_path:
+        from capture import Recorder
+        recorder = Recorder(capture_path, width=cpu.screen.width, height=cpu.screen.height, scale=capture_scale)
+        recorder.add_frame(cpu.screen.display_buffer, 0)
+
+    # frame pacing metrics, only measured when asked for
+    telemetry = None
+    metrics_server = None
+    if metrics_file or metrics_port or telemetry_overlay:
+        from telemetry import Telemetry, MetricsServer
+        telemetry = Telemetry(FRAME_TIME)
+        if metrics_port:
+            metrics_server = MetricsServer(telemetry, metrics_port)
+
+    # game loop, one iteration per 60 Hz frame
+    frame = 0
+    next_frame_time = time.perf_counter()
+    try:
+        while cpu.is_running:
+            if telemetry:
+                telemetry.frame_started()
 
+            # execute one frame worth of instructions and decrement timers
+            executed = cpu.run_frame(frame_instructions)
+            frame += 1
+            if telemetry:
+                telemetry.cpu_finished(executed)
 
+            # print debug data
+            if logger.isEnabledFor(DEBUG):
+                logger.debug(cpu.get_debug_data())
+
+            # update display if required
+            presented = False
+            skipped = False
+            if cpu.screen.needs_screen_update:
+                if recorder:
+                    recorder.add_frame(cpu.screen.display_buffer, frame)
+                if frame_skipper is None:
+                    draw_frame()
+                    presented = True
+                elif frame_skipper.should_present(next_frame_time + FRAME_TIME):
+                    frame_skipper.present(draw_frame)
+                    presented = True
+                else:
+                    skipped = True
+            if publisher:
+                publisher.publish(cpu)
+            if telemetry:
+                telemetry.render_finished(presented, skipped)
+
+            if backend == 'pygame':
+                # Check for keyboard events
+                rom = handle_pygame_events(cpu, telemetry)
+                if rom:
+                    try:
+                        frame_instructions = load_rom(cpu, database, rom, instructions_per_frame, shift_Vy)
+                    except Exception as error:
+                        logger.error("Can not load {}, keeping current ROM: {}".format(rom, error))
+            if telemetry:
+                telemetry.events_finished()
+
+            # Wait for next frame. If running late, catch up without sleeping while
+            # frames are skipped, otherwise do not try to catch up.
+            next_frame_time += FRAME_TIME
+            delay = next_frame_time - time.perf_counter()
+            dropped = 0
+            if delay > 0:
+                time.sleep(delay)
+            elif frame_skipper is None or -delay > frame_skipper.max_skip * FRAME_TIME:
+                dropped = int(-delay / FRAME_TIME)
+                next_frame_time = time.perf_counter()
+            if telemetry and telemetry.frame_finished(delay, dropped):
+                if metrics_file:
+                    telemetry.write_file(metrics_file)
+                if telemetry_overlay:
+                    cpu.screen.overlay_text = telemetry.overlay_text()
+                    cpu.screen.needs_screen_update = True
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if publisher:
+            publisher.close()
+        if recorder:
+            recorder.add_frame(cpu.screen.display_buffer, frame)
+            recorder.close()
+            if recorder.dropped_frames:
+                print("Capture dropped {} of {} changed frames as encoding could not keep up".format(
+                    recorder.dropped_frames, recorder.dropped_frames + recorder.frames_captured))
+        if metrics_file:
+            telemetry.write_file(metrics_file)
+        if metrics_server:
+            metrics_server.close()
+        if frame_skipper and frame_skipper.skipped_frames:
+            print("Skipped drawing {} of {} frames to keep emulation at full speed".format(
+                frame_skipper.skipped_frames, frame))
+
+def measure_startup(binary, backend='pygame', repeat=5):
+    """
+    Print time taken by each startup step until first instruction is executed,
+    and time taken to switch to another ROM.
+    :param binary: path to ROM
+    :param backend: one of BACKENDS
+    :param repeat: number of ROM switches to average
+    :return: None
+    """
+    start = time.perf_counter()
+    imports = start - APP_START_TIME
+    cpu = create_cpu(binary, backend)
+    created = time.perf_counter()
+    database = RomDatabase()
+    database_loaded = time.perf_counter()
+    load_rom(cpu, database, binary)
+    loaded = time.perf_counter()
+    cpu.execute_one_instruction()
+    first_instruction = time.perf_counter()
+    for _ in range(repeat):
+        load_rom(cpu, database, binary)
+        cpu.execute_one_instruction()
+    reset = (time.perf_counter() - first_instruction) / repeat
+    cpu.destroy_display()
+
+    print("Backend:               {}".format(backend))
+    print("Imports:               {:8.2f} ms".format(imports * 1000))
+    print("Display and sound:     {:8.2f} ms".format((created - start) * 1000))
+    print("ROM database:          {:8.2f} ms".format((database_loaded - created) * 1000))
+    print("Load ROM:              {:8.2f} ms".format((loaded - database_loaded) * 1000))
+    print("First instruction:     {:8.2f} ms".format((first_instruction - loaded) * 1000))
+    print("Total to first opcode: {:8.2f} ms".format((first_instruction - APP_START_TIME) * 1000))
+    print("ROM switch:            {:8.2f} ms".format(reset * 1000))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='CHIP-8 Emulator')
+    parser.add_argument('rom', metavar='ROM_PATH', help='path to CHIP-8 ROM')
+    parser.add_argument('--backend', choices=BACKENDS, default='pygame',
+                        help='display backend (default: pygame)')
+    parser.add_argument('--engine', choices=ENGINES, default='reference',
+                        help='execution engine (default: reference)')
+    parser.add_argument('--instructions-per-frame', metavar='N', type=int, default=None,
+                        help='instructions per 60 Hz frame (default: from ROM database, else 10)')
+    parser.add_argument('--shift-vy', action=argparse.BooleanOptionalAction, default=None,
+                        help='8XY6/8XYE shift VY into VX (default: from ROM database, else off)')
+    parser.add_argument('--shared-memory', metavar='NAME', default=None,
+                        help='publish framebuffer and registers to shared memory block NAME')
+    parser.add_argument('--capture', metavar='PATH', default=None,
+                        help='record gameplay to PATH (.gif, .png sequence or .raw RGB24 video)')
+    parser.add_argument('--capture-scale', metavar='N', type=int, default=4,
+                        help='scale factor for captured frames (default: 4)')
+    parser.add_argument('--metrics-file', metavar='PATH', default=None,
+                        help='write Prometheus text metrics to PATH every second')
+    parser.add_argument('--metrics-port', metavar='PORT', type=int, default=None,
+                        help='serve Prometheus metrics at http://127.0.0.1:PORT/metrics')
+    parser.add_argument('--telemetry-overlay', action='store_true',
+                        help='show FPS, IPS, late frames and input latency on screen')
+    parser.add_argument('--max-frame-skip', metavar='N', type=int, default=DEFAULT_MAX_SKIP,
+                        help='most frames skipped in a row when drawing falls behind, 0 disables '
+                             '(default: {})'.format(DEFAULT_MAX_SKIP))
+    parser.add_argument('--measure-startup', action='store_true',
+                        help='print startup time until first executed instruction and exit')
+    args = parser.parse_args()
+    if args.measure_startup:
+        measure_startup(binary=args.rom, backend=args.backend)
+    else:
+        main_loop(binary=args.rom, backend=args.backend, engine=args.engine,
+                  instructions_per_frame=args.instructions_per_frame, shift_Vy=args.shift_vy,
+                  shared_memory_name=args.shared_memory, capture_path=args.capture, capture_scale=args.capture_scale,
+                  metrics_file=args.metrics_file, metrics_port=args.metrics_port, telemetry_overlay=args.telemetry_overlay,
+                  max_frame_skip=args.max_frame_skip)
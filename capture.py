@@ -0,0 +1,387 @@
+__author__ = 'jaya'
+
+# External imports
+import os
+import signal
+import struct
+import multiprocessing
+import zlib
+import queue
+
+# Local imports
+from log import create_logger
+from display import BACKGROUND_COLOR, FOREGROUND_COLOR
+
+# Setup logger
+logger = create_logger(__name__)
+
+# Set logging level
+DEBUG = 10
+NOTSET = 0
+logger.setLevel(NOTSET)
+
+# Constants
+FRAME_RATE = 60
+# Most GIF viewers show frames shorter than 2/100 sec for 1/10 sec, so shorter frames are merged.
+GIF_MIN_DELAY = 2
+GIF_MAX_CODE = 4096
+# Changed frames waiting for the encoder process. Encoding a frame takes about
+# 5-17 ms at scale 4 while frames can change every 16.7 ms, so when the encoder
+# falls behind frames are dropped instead of queued without limit.
+MAX_QUEUED_FRAMES = 120
+DEFAULT_SCALE = 4
+
+def scale_frame(frame, width, height, scale):
+    """
+    Scale frame of one byte per pixel by integer factor.
+    :param frame: bytes, one byte per pixel
+    :param width: width of frame
+    :param height: height of frame
+    :param scale: scale factor
+    :return: list of scaled rows, each row is bytes of one byte per pixel
+    """
+    rows = list()
+    for y in range(height):
+        row = frame[y * width: (y + 1) * width]
+        if scale > 1:
+            row = bytes(pixel for pixel in row for _ in range(scale))
+        else:
+            row = bytes(row)
+        rows.extend([row] * scale)
+    return rows
+
+def lzw_encode(pixels, min_code_size=2):
+    """
+    Compress pixel indices with variable length LZW as used by GIF.
+    :param pixels: bytes of palette indices
+    :param min_code_size: LZW minimum code size
+    :return: compressed bytes (not yet split to sub blocks)
+    """
+    clear_code = 1 << min_code_size
+    end_code = clear_code + 1
+    code_size = min_code_size + 1
+    next_code = end_code + 1
+    table = dict()
+    output = bytearray()
+    bit_buffer = clear_code
+    bit_count = code_size
+
+    prefix = pixels[0]
+    for pixel in pixels[1:]:
+        key = (prefix << 8) | pixel
+        code = table.get(key)
+        if code is not None:
+            prefix = code
+            continue
+        bit_buffer |= prefix << bit_count
+        bit_count += code_size
+        if next_code < GIF_MAX_CODE:
+            table[key] = next_code
+            next_code += 1
+            if next_code > (1 << code_size) and code_size < 12:
+                code_size += 1
+        else:
+            # table is full, start again
+            bit_buffer |= clear_code << bit_count
+            bit_count += code_size
+            table.clear()
+            code_size = min_code_size + 1
+            next_code = end_code + 1
+        while bit_count >= 8:
+            output.append(bit_buffer & 0xFF)
+            bit_buffer >>= 8
+            bit_count -= 8
+        prefix = pixel
+
+    bit_buffer |= prefix << bit_count
+    bit_count += code_size
+    bit_buffer |= end_code << bit_count
+    bit_count += code_size
+    while bit_count > 0:
+        output.append(bit_buffer & 0xFF)
+        bit_buffer >>= 8
+        bit_count -= 8
+    return bytes(output)
+
+
+class GifEncoder(object):
+    def __init__(self, path, width, height):
+        """
+        Animated GIF writer with two colour palette.
+        :param path: output file path
+        :param width: width of image in pixels
+        :param height: height of image in pixels
+        """
+        self.width = width
+        self.height = height
+        self.elapsed = 0  # frames written so far, in 1/60 sec
+        self.written = 0  # delay written so far, in 1/100 sec
+        self.skipped_rows = None
+        self.fh = open(path, 'wb')
+        self.fh.write(b'GIF89a')
+        # Logical screen descriptor with 2 entry global colour table
+        self.fh.write(struct.pack('<HHBBB', width, height, 0x80, 0, 0))
+        self.fh.write(bytes(BACKGROUND_COLOR) + bytes(FOREGROUND_COLOR))
+        # Loop forever
+        self.fh.write(b'\x21\xFF\x0BNETSCAPE2.0\x03\x01\x00\x00\x00')
+
+    def write_frame(self, rows, frame_number, duration):
+        """
+        Append frame shown for duration frames.
+        :param rows: scaled rows of pixel indices
+        :param frame_number: frame number when the frame was captured
+        :param duration: number of 1/60 sec frames the frame is shown
+        :return: None
+        """
+        self.elapsed += duration
+        delay = (self.elapsed * 100) // FRAME_RATE - self.written
+        if delay < GIF_MIN_DELAY:
+            self.skipped_rows = rows
+            return
+        self.skipped_rows = None
+        self.written += delay
+        self.write_image(rows, delay)
+
+    def write_image(self, rows, delay):
+        """
+        Write one image block
+        :param rows: scaled rows of pixel indices
+        :param delay: delay in 1/100 sec
+        :return: None
+        """
+        # Graphic control extension, disposal - do not dispose
+        self.fh.write(struct.pack('<BBBBHBB', 0x21, 0xF9, 4, 0x04, delay, 0, 0))
+        # Image descriptor
+        self.fh.write(struct.pack('<BHHHHB', 0x2C, 0, 0, self.width, self.height, 0))
+        data = lzw_encode(b''.join(rows), 2)
+        self.fh.write(b'\x02')
+        for index in range(0, len(data), 255):
+            block = data[index: index + 255]
+            self.fh.write(struct.pack('B', len(block)) + block)
+        self.fh.write(b'\x00')
+
+    def close(self):
+        if self.skipped_rows is not None:
+            self.write_image(self.skipped_rows, GIF_MIN_DELAY)
+        self.fh.write(b'\x3B')
+        self.fh.close()
+
+
+class PngSequenceEncoder(object):
+    def __init__(self, path, width, height):
+        """
+        Writes each changed frame as a 1 bit palette PNG.
+        File names contain the frame number, so unchanged frames can be filled in later.
+        :param path: file name pattern like "frames/frame_%06d.png"
+        :param width: width of image in pixels
+        :param height: height of image in pixels
+        """
+        self.path = path
+        self.width = width
+        self.height = height
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.header = self.chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 1, 3, 0, 0, 0)) + \
+            self.chunk(b'PLTE', bytes(BACKGROUND_COLOR) + bytes(FOREGROUND_COLOR))
+
+    @staticmethod
+    def chunk(chunk_type, data):
+        return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', zlib.crc32(chunk_type + data) & 0xFFFFFFFF)
+
+    def write_frame(self, rows, frame_number, duration):
+        raw = bytearray()
+        for row in rows:
+            raw.append(0)  # filter type none
+            for index in range(0, self.width, 8):
+                pixels = row[index: index + 8]
+                byte = 0
+                for pixel in pixels:
+                    byte = (byte << 1) | pixel
+                raw.append(byte << (8 - len(pixels)))
+        with open(self.path % frame_number, 'wb') as fh:
+            fh.write(b'\x89PNG\r\n\x1a\n' + self.header)
+            fh.write(self.chunk(b'IDAT', zlib.compress(bytes(raw), 9)))
+            fh.write(self.chunk(b'IEND', b''))
+
+    def close(self):
+        pass
+
+
+class RawVideoEncoder(object):
+    def __init__(self, path, width, height):
+        """
+        Writes constant frame rate RGB24 video with no header. Convert with
+        ffmpeg -f rawvideo -pix_fmt rgb24 -s WIDTHxHEIGHT -r 60 -i PATH out.mp4
+        :param path: output file path
+        :param width: width of image in pixels
+        :param height: height of image in pixels
+        """
+        self.fh = open(path, 'wb')
+        self.colours = (bytes(BACKGROUND_COLOR), bytes(FOREGROUND_COLOR))
+
+    def write_frame(self, rows, frame_number, duration):
+        colours = self.colours
+        frame = b''.join(colours[pixel] for row in rows for pixel in row)
+        for _ in range(duration):
+            self.fh.write(frame)
+
+    def close(self):
+        self.fh.close()
+
+
+ENCODERS = {
+    'gif': GifEncoder,
+    'png': PngSequenceEncoder,
+    'raw': RawVideoEncoder
+}
+
+
+def encode_frames(frames, status, encoder, path, width, height, scale):
+    """
+    Encoder process. Sends None on status once output is open, or the error that
+    stopped encoding. Each frame is written when the next one arrives, as only
+    then it is known how long it was shown.
+    :param frames: queue of (frame number, frame) tuples, frame None ends the recording
+    :param status: write end of status pipe
+    :param encoder: one of ENCODERS keys
+    :param path: output path
+    :param width: width of framebuffer
+    :param height: height of framebuffer
+    :param scale: integer scale factor for output images
+    :return: None
+    """
+    # Ctrl+C goes to the whole process group, the emulator closes the recording
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        output = ENCODERS[encoder](path, width * scale, height * scale)
+        status.send(None)
+        pending = None
+        while True:
+            frame_number, frame = frames.get()
+            if pending is not None and frame is not None and frame_number <= pending[0]:
+                # several changes within one 1/60 sec frame, only the last one is visible
+                pending = (pending[0], frame)
+                continue
+            if pending is not None:
+                pending_number, pending_frame = pending
+                rows = scale_frame(pending_frame, width, height, scale)
+                output.write_frame(rows, pending_number, max(1, frame_number - pending_number))
+            if frame is None:
+                break
+            pending = (frame_number, frame)
+        output.close()
+    except Exception as error:
+        status.send("{}: {}".format(type(error).__name__, error))
+
+
+class Recorder(object):
+    def __init__(self, path, width=64, height=32, scale=DEFAULT_SCALE, encoder=None,
+                 max_queued_frames=MAX_QUEUED_FRAMES):
+        """
+        Record framebuffer to animated GIF, PNG sequence or raw video.
+        Only changed frames are sent, as raw one byte per pixel framebuffers, to an
+        encoder process, so scaling and compression do not hold the GIL of the
+        emulator. When the queue is full new frames are dropped and counted in
+        dropped_frames, the previous frame is then shown for longer.
+        :param path: output path. Format is chosen by extension (.gif, .png, .raw)
+                     unless encoder is given. For PNG, frame number is added to the
+                     file name unless path already contains a %d pattern.
+        :param width: width of framebuffer
+        :param height: height of framebuffer
+        :param scale: integer scale factor for output images
+        :param encoder: one of ENCODERS keys
+        :param max_queued_frames: most frames waiting to be encoded
+        """
+        if encoder is None:
+            encoder = os.path.splitext(path)[1].lstrip('.').lower()
+        if encoder not in ENCODERS:
+            raise Exception("Unknown capture format '{}'. Use one of {}".format(encoder, ', '.join(sorted(ENCODERS))))
+        if encoder == 'png' and '%' not in path:
+            path = os.path.splitext(path)[0] + '_%06d.png'
+        self.path = path
+        self.width = width
+        self.height = height
+        self.scale = scale
+        self.last_frame = None
+        self.last_frame_number = 0
+        self.frames_captured = 0
+        self.dropped_frames = 0
+        self.error = None  # message of the error that stopped the encoder process
+        self.frames = multiprocessing.Queue(max_queued_frames)
+        self.status, status = multiprocessing.Pipe(duplex=False)
+        self.process = multiprocessing.Process(target=encode_frames, name='capture',
+                                               args=(self.frames, status, encoder, path, width, height, scale))
+        self.process.daemon = True
+        self.process.start()
+        status.close()
+        # wait until output is open, so a bad path fails here and not on exit
+        if self.poll_encoder(block=True):
+            self.process.join()
+            raise Exception("Cannot capture to {}: {}".format(path, self.error))
+        logger.debug("Capturing frames to {}".format(path))
+
+    def poll_encoder(self, block=False):
+        """
+        Pick up the error reported by the encoder process and log it.
+        :param block: wait for a status message
+        :return: error message or None
+        """
+        if self.error is not None or not (block or self.status.poll()):
+            return self.error
+        try:
+            self.error = self.status.recv()
+        except EOFError:
+            # encoder process ended without a message, fine only after the end of the recording
+            self.process.join()
+            if self.process.exitcode != 0:
+                self.error = "encoder process exited with code {}".format(self.process.exitcode)
+        if self.error is not None:
+            logger.error("Capture to {} stopped: {}".format(self.path, self.error))
+        return self.error
+
+    def add_frame(self, display_buffer, frame_number):
+        """
+        Queue frame if it is different from previous one. Never blocks: the frame
+        is dropped if the queue is full.
+        :param display_buffer: framebuffer, one byte per pixel
+        :param frame_number: number of 1/60 sec frames since start of recording
+        :return: None
+        """
+        self.last_frame_number = frame_number
+        if self.error is not None:
+            return
+        if self.last_frame is not None and display_buffer == self.last_frame:
+            return
+        frame = bytes(display_buffer)
+        try:
+            self.frames.put_nowait((frame_number, frame))
+        except queue.Full:
+            # a full queue is also what a stopped encoder looks like
+            if self.poll_encoder() is None:
+                self.dropped_frames += 1
+            return
+        self.last_frame = frame
+        self.frames_captured += 1
+
+    def close(self):
+        """
+        Flush queued frames and close output. Last frame is shown until last add_frame call.
+        Does not wait for an encoder process that already stopped on an error.
+        :return: None
+        """
+        end = (max(self.last_frame_number, 0) + 1, None)
+        while self.process.is_alive() and self.poll_encoder() is None:
+            try:
+                self.frames.put(end, timeout=0.1)
+                break
+            except queue.Full:
+                pass
+        self.process.join()
+        self.poll_encoder(block=True)
+        self.status.close()
+        # frames left after an error have no reader, do not wait for them on exit
+        self.frames.cancel_join_thread()
+        self.frames.close()
+        logger.debug("Captured {} changed frames to {}, dropped {}".format(self.frames_captured, self.path,
+                                                                           self.dropped_frames))
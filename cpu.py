@@ -2,8 +2,8 @@ __author__ = 'jaya'
 
 # External imports
 import time
-import pygame
-from random import randrange
+from collections import namedtuple
+from random import Random
 
 # Local imports
 from log import create_logger
@@ -16,6 +16,10 @@ DEBUG = 10
 NOTSET = 0
 logger.setLevel(NOTSET)
 
+# reference - decode and execute one instruction at a time.
+# fused - common instruction sequences run as single fused handlers. See fusion.py
+ENGINES = ('reference', 'fused')
+
 class CPU(object):
 
     def __init__(self, binary='roms/PONG', screen=None, sound='pong.wav'):
@@ -24,6 +28,7 @@ class CPU(object):
         and registers.
         :param binary: Path to binary file.
         :param screen: Pygame screen object.
+        :param sound: Path to music file played as beep. No sound if None.
         """
         self.is_running = False
         self.total_memory = 4096  # 4096 Bytes - 4kb
@@ -36,11 +41,12 @@ class CPU(object):
         self.program_end_point = 0
         self.screen = screen
         # This dictionary is organized to resemble the 1977 COSMAC VIP's keyboard
+        # Pygame key constants of these keys are same as their ASCII values
         self.keyboard_mapping = {
-            pygame.K_1: 0x1, pygame.K_2: 0x2, pygame.K_3: 0x3, pygame.K_4: 0xC,
-            pygame.K_q: 0x4, pygame.K_w: 0x5, pygame.K_e: 0x6, pygame.K_r: 0xD,
-            pygame.K_a: 0x7, pygame.K_s: 0x8, pygame.K_d: 0x9, pygame.K_f: 0xE,
-            pygame.K_z: 0xA, pygame.K_x: 0x0, pygame.K_c: 0xB, pygame.K_v: 0xF
+            ord('1'): 0x1, ord('2'): 0x2, ord('3'): 0x3, ord('4'): 0xC,
+            ord('q'): 0x4, ord('w'): 0x5, ord('e'): 0x6, ord('r'): 0xD,
+            ord('a'): 0x7, ord('s'): 0x8, ord('d'): 0x9, ord('f'): 0xE,
+            ord('z'): 0xA, ord('x'): 0x0, ord('c'): 0xB, ord('v'): 0xF
         }
         self.keys_pressed = [0] * 16
         self.hex_to_binary_display = {
@@ -82,27 +88,74 @@ class CPU(object):
         }
         self.cpu_cycle_start_time = 0
         self.cpu_cycle_end_time = 0
+        # Timers are decremented by wall clock time between instructions. Frame based
+        # callers like run_frame turn it off to get deterministic 60 Hz timers.
+        self.realtime_timers = True
+        self.eight_function_map = {
+            0x0: self.eight_load,
+            0x1: self.eight_or,
+            0x2: self.eight_and,
+            0x3: self.eight_xor,
+            0x4: self.eight_add,
+            0x5: self.eight_sub,
+            0x6: self.eight_shift_right,
+            0x7: self.eight_subn,
+            0xE: self.eight_shift_left
+        }
         # shift_Vy is a compatibility flag that can be toggled off/on
         # shift VX instead of VY. Check instructions 8XY6 and 8XYE. Many games
         # like "BLINKY" requires it off
         self.shift_Vy = False
+        self.music = None
+        self.debugger = None
+        self.engine = None
+        # Static analysis of loaded program (analysis.ProgramAnalysis), if known
+        self.analysis = None
+        self.state_views = None
+        # Set by Fx0A while no key is pressed. run_frame ends the frame then.
+        self.waiting_for_key = False
+        # Random number generator of Cxkk. Seed it for reproducible runs.
+        self.random = Random()
         self.initialize_sound(sound)
 
+    @property
+    def shift_Vy(self):
+        return self.eight_function_map[0x6] == self.eight_shift_right_vy
+
+    @shift_Vy.setter
+    def shift_Vy(self, enabled):
+        """
+        Select 8XY6 and 8XYE handlers once, instead of checking the flag on every instruction.
+        :param enabled: True to shift VY into VX, False to shift VX in place
+        :return: None
+        """
+        if enabled:
+            self.eight_function_map[0x6] = self.eight_shift_right_vy
+            self.eight_function_map[0xE] = self.eight_shift_left_vy
+        else:
+            self.eight_function_map[0x6] = self.eight_shift_right
+            self.eight_function_map[0xE] = self.eight_shift_left
+
     def initialize_sound(self, music_file):
         """
-        Initialize pygame music
-        :param music_file: path to music file
+        Initialize pygame music. Pygame is imported only when sound is used.
+        :param music_file: path to music file. Sound is disabled if None.
         :return: None
         """
+        if music_file is None:
+            return
+        import pygame
         pygame.mixer.init()
         pygame.mixer.music.load(music_file)
+        self.music = pygame.mixer.music
 
     def play_music(self):
         """
         Beep or play music once
         :return: None
         """
-        pygame.mixer.music.play()
+        if self.music is not None:
+            self.music.play()
 
     def destroy_display(self):
         """
@@ -111,15 +164,63 @@ class CPU(object):
         """
         self.screen.destroy()
 
+    def get_debugger(self):
+        """
+        Get debugger for breakpoints, watchpoints and stepping. Created on first use.
+        Instructions are executed without any checks until a breakpoint or watchpoint is set.
+        :return: Debugger object
+        """
+        if self.debugger is None:
+            from debugger import Debugger
+            self.debugger = Debugger(self)
+        return self.debugger
+
+    def inspect(self):
+        """
+        Read-only views of memory, V registers and display buffer. Nothing is copied
+        and the views follow the running program, so they can be created once and
+        sampled at any rate. Use status() for program counter, I, timers and stack pointer.
+        The views stay valid across reset() only because these buffers are never resized:
+        reset and ROM loading overwrite them in place, and validate_binary rejects ROMs
+        that do not fit in memory. Resizing an exported buffer raises BufferError.
+        :return: CPU.StateViews
+        """
+        if self.state_views is None:
+            self.state_views = CPU.StateViews(memoryview(self.memory_buffer).toreadonly(),
+                                              memoryview(self.registers.v).toreadonly(),
+                                              memoryview(self.screen.display_buffer).toreadonly())
+        return self.state_views
+
+    def status(self):
+        """
+        Small snapshot of scalar registers
+        :return: CPU.Status
+        """
+        registers = self.registers
+        return CPU.Status(self.program_counter, registers.i, registers.delay_timer, registers.sound_timer,
+                          self.stack_depth())
+
+    def stack_depth(self):
+        """
+        Number of return addresses pushed by CALL and not yet returned. The stack is
+        created with 16 zero entries, which are not counted.
+        :return: depth, negative after more returns than calls
+        """
+        return len(self.stack) - 16
+
     def get_debug_data(self):
         """
         Dump CPU Memory and registers for easy debugging.
         :return: String containing all the data
         """
         return_string = str()
-        return_string += "\nOpcode Executed: 0x{:04X}, x: 0x{:01X}, y: 0x{:01X}, kk: 0x{:02X}, nnn: 0x{:03X}, n: 0x{:01X}\n".\
-            format(self.current_instruction.opcode, self.current_instruction.x, self.current_instruction.y,
-                   self.current_instruction.kk, self.current_instruction.nnn, self.current_instruction.n)
+        # Nothing was executed yet after initialize_cpu or reset
+        if self.current_instruction is not None:
+            return_string += "\nOpcode Executed: 0x{:04X}, x: 0x{:01X}, y: 0x{:01X}, kk: 0x{:02X}, nnn: 0x{:03X}, n: 0x{:01X}\n".\
+                format(self.current_instruction.opcode, self.current_instruction.x, self.current_instruction.y,
+                       self.current_instruction.kk, self.current_instruction.nnn, self.current_instruction.n)
+        else:
+            return_string += "\nOpcode Executed: none\n"
         return_string += "Stack: {}\n".format(' '.join(map(hex,self.stack)))
         return_string += "Program Counter: 0x{:04X}\n".format(self.program_counter)
         return_string += "V Registers: {}\n".format(' '.join(map(hex,self.registers.v)))
@@ -143,9 +244,68 @@ class CPU(object):
         self.process_binary()
         logger.debug("Set Program counter to Memory address 512(0x200)")
         self.program_counter = 0x200
+        if self.engine is not None:
+            self.engine.load_program()
         logger.debug("CPU stared running")
         self.is_running = True
 
+    def set_engine(self, engine):
+        """
+        Select execution engine. See ENGINES.
+        Engines replace execute_one_instruction and run_frame of this CPU object.
+        While debugger checks are on, they stay in place and the new engine is
+        used once the last breakpoint, condition and watchpoint is removed.
+        :param engine: engine name
+        :return: None
+        """
+        if engine not in ENGINES:
+            raise Exception("Unknown engine {}. Use one of {}".format(engine, ', '.join(ENGINES)))
+        debugger = self.debugger
+        if debugger is not None and debugger.engine is not None:
+            debugger.remove_checks()
+            self.set_engine(engine)
+            debugger.install_checks()
+            return
+        logger.debug("Using {} engine".format(engine))
+        self.__dict__.pop('execute_one_instruction', None)
+        self.__dict__.pop('run_frame', None)
+        self.engine = None
+        if engine == 'fused':
+            from fusion import FusedEngine
+            self.engine = FusedEngine(self)
+            self.execute_one_instruction = self.engine.execute_one_instruction
+            self.run_frame = self.engine.run_frame
+            if self.is_running:
+                self.engine.load_program()
+
+    def reset(self, binary=None):
+        """
+        Reset registers, memory and display buffer and load given binary.
+        Display, sound and opcode tables are reused, so switching ROMs
+        does not need a new process or window. Binary is validated first,
+        nothing is changed if it can not be read or is not valid.
+        :param binary: Path to binary file. Current binary is reloaded if None.
+        :return: None
+        """
+        logger.debug("Resetting CPU")
+        self.validate_binary(binary)
+        if binary is not None:
+            self.binary_file = binary
+        self.is_running = False
+        self.memory_buffer[:] = bytes(self.total_memory)
+        self.registers.clear()
+        self.program_counter = 0
+        self.stack[:] = [0] * 16
+        self.binary_size_in_bytes = 0
+        self.program_end_point = 0
+        self.keys_pressed[:] = [0] * 16
+        self.current_instruction = None
+        self.cpu_cycle_start_time = 0
+        self.cpu_cycle_end_time = 0
+        if self.screen is not None:
+            self.screen.clear_display_buffer()
+        self.initialize_cpu()
+
     def copy_fonts_to_memory(self):
         """
         Copy default hex sprite to memory
@@ -158,15 +318,20 @@ class CPU(object):
             index += 5
         logger.debug("Fonts copied to memory successfully")
 
-    def validate_binary(self):
+    def validate_binary(self, binary_file=None):
         """
-        Validate if all the opcodes are valid in given binary.
-        :return:
+        Validate if given binary fits in memory and all the opcodes are valid.
+        :param binary_file: Path to binary file. Current binary is validated if None.
+        :return: None
         """
-        logger.debug("Validating binary {}".format(self.binary_file))
-        fh = open(self.binary_file, 'rb')
-        contents = bytearray(fh.read())
+        if binary_file is None:
+            binary_file = self.binary_file
+        logger.debug("Validating binary {}".format(binary_file))
+        with open(binary_file, 'rb') as fh:
+            contents = bytearray(fh.read())
         logger.debug("Size of binary: 0x{:02X}({}) bytes".format(len(contents), len(contents)))
+        if len(contents) > self.total_memory - 0x200:
+            raise Exception("Binary is {} bytes, only {} bytes fit in memory".format(len(contents), self.total_memory - 0x200))
         count = 0
         while count < len(contents)-1:
             opcode = (contents[count] << 8) | (contents[count+1])
@@ -184,8 +349,8 @@ class CPU(object):
         :return: None
         """
         logger.debug("Processing binary {}".format(self.binary_file))
-        fh = open(self.binary_file, 'rb')
-        contents = bytearray(fh.read())
+        with open(self.binary_file, 'rb') as fh:
+            contents = bytearray(fh.read())
         self.binary_size_in_bytes = len(contents)
         logger.debug("Binary size in bytes: 0x{:02X}({})".format(self.binary_size_in_bytes, self.binary_size_in_bytes))
         logger.debug("Copying binary contents to memory")
@@ -193,20 +358,17 @@ class CPU(object):
         self.program_end_point = 0x200+self.binary_size_in_bytes
         logger.debug("Binary copied to memory successfully")
 
-    def update_keys_pressed(self, ascii_key, event_type):
+    def update_keys_pressed(self, ascii_key, pressed):
         """
         Update key press events for given key
         :param ascii_key: ASCII value of pressed key. Get it from Pygame constants.
-        :param event_type: Key up or down event
+        :param pressed: True for key down event, False for key up event
         :return: None
         """
         if ascii_key in self.keyboard_mapping:
             logger.debug("{} is pressed".format(ascii_key))
             key = self.keyboard_mapping[ascii_key]
-            if event_type == pygame.KEYDOWN:
-                self.keys_pressed[key] = 1
-            elif event_type == pygame.KEYUP:
-                self.keys_pressed[key]  = 0
+            self.keys_pressed[key] = 1 if pressed else 0
 
     def execute_one_instruction(self):
         """
@@ -220,21 +382,101 @@ class CPU(object):
             opcode = (self.memory_buffer[self.program_counter] << 8) | (self.memory_buffer[self.program_counter+1])
             self.current_instruction = CPU.CurrentInstruction(opcode)
             self.execute_opcode()
-            self.cpu_cycle_end_time = time.time()
-            # self.current_instruction.clear()
-            if (self.cpu_cycle_end_time - self.cpu_cycle_start_time) >= 1/60:
-                if self.registers.delay_timer > 0:
-                    self.registers.delay_timer -= 1
-
-                if self.registers.sound_timer > 0:
-                    self.registers.sound_timer -= 1
-                    self.play_music()
-                self.cpu_cycle_start_time = self.cpu_cycle_end_time
+            if self.realtime_timers:
+                self.update_realtime_timers()
             self.program_counter += 2
         else:
             logger.debug("Program reached end. Stop CPU execution")
             self.is_running = False
 
+    def update_realtime_timers(self):
+        """
+        Decrement timers if 1/60 sec passed since they were last decremented.
+        :return: None
+        """
+        self.cpu_cycle_end_time = time.time()
+        if (self.cpu_cycle_end_time - self.cpu_cycle_start_time) >= 1/60:
+            self.tick_timers()
+            self.cpu_cycle_start_time = self.cpu_cycle_end_time
+
+    def tick_timers(self):
+        """
+        Decrement delay and sound timers. Called at 60 Hz.
+        :return: None
+        """
+        if self.registers.delay_timer > 0:
+            self.registers.delay_timer -= 1
+
+        if self.registers.sound_timer > 0:
+            self.registers.sound_timer -= 1
+            self.play_music()
+
+    def run_frame(self, instructions_per_frame):
+        """
+        Execute one 60 Hz frame worth of instructions. Timers are decremented
+        once at the end of frame unless realtime_timers is on. Keys only change
+        between frames, so the frame ends early when Fx0A waits for a key.
+        :param instructions_per_frame: number of instructions to execute
+        :return: number of instructions executed, not counting a waiting Fx0A
+        """
+        executed = 0
+        self.waiting_for_key = False
+        while executed < instructions_per_frame and self.is_running:
+            self.execute_one_instruction()
+            if self.waiting_for_key:
+                break
+            executed += 1
+        if not self.realtime_timers:
+            self.tick_timers()
+        return executed
+
+    def frames(self, instructions_per_frame, inputs=None, deltas=False):
+        """
+        Run program one 60 Hz frame at a time, as a generator. Nothing runs until
+        the next frame is asked for, so the caller sets the pace. Timers are ticked
+        once per frame (realtime_timers is turned off). Program is loaded first if
+        it was not yet. Keys held for the next frame can also be given with send().
+        :param instructions_per_frame: number of instructions to execute per frame
+        :param inputs: iterable with one item per frame: CHIP-8 keys (0x0-0xF) held
+                       during that frame, or None to keep keys unchanged. Frames stop
+                       when it is exhausted. Keys are not changed if inputs is None.
+        :param deltas: if True, frames carry only display rows changed since previous frame
+        :return: generator of CPU.Frame, until program stops
+        """
+        self.realtime_timers = False
+        if self.program_counter == 0:
+            self.initialize_cpu()
+        inputs = iter(inputs) if inputs is not None else None
+        screen = self.screen
+        width = screen.width
+        previous = bytes(screen.display_buffer)
+        number = 0
+        keys = None
+        while self.is_running:
+            if inputs is not None:
+                try:
+                    frame_keys = next(inputs)
+                except StopIteration:
+                    return
+                keys = frame_keys if frame_keys is not None else keys
+            if keys is not None:
+                held = set(keys)
+                self.keys_pressed[:] = [1 if key in held else 0 for key in range(16)]
+            self.run_frame(instructions_per_frame)
+            number += 1
+            display_buffer = bytes(screen.display_buffer)
+            if deltas:
+                changed_rows = [(y, display_buffer[start: start + width])
+                                for y, start in enumerate(range(0, len(display_buffer), width))
+                                if display_buffer[start: start + width] != previous[start: start + width]]
+                frame = CPU.Frame(number, None, changed_rows, self.registers.sound_timer > 0)
+            else:
+                frame = CPU.Frame(number, display_buffer, None, self.registers.sound_timer > 0)
+            previous = display_buffer
+            sent_keys = yield frame
+            if sent_keys is not None:
+                keys = sent_keys
+
     def execute_opcode(self):
         """
         Execute opcode pointed by current instruction
@@ -422,118 +664,142 @@ class CPU(object):
         Adds the value kk to the value of register Vx, then stores the result in Vx.
         """
         logger.debug("ADD V{:01X}, 0x{:02X}".format(self.current_instruction.x, self.current_instruction.kk))
-        self.registers.v[self.current_instruction.x] += self.current_instruction.kk
-        self.registers.v[self.current_instruction.x] &= 0xFF # truncate to 8 bits
+        self.registers.v[self.current_instruction.x] = (self.registers.v[self.current_instruction.x] + self.current_instruction.kk) & 0xFF # truncate to 8 bits
 
     def eight(self):
-        if self.current_instruction.n == 0:
-            """
-            8xy0 - LD Vx, Vy
-            Set Vx = Vy.
-            Stores the value of register Vy in register Vx.
-            """
-            logger.debug("LD V{:01X}, V{:01X}".format(self.current_instruction.x, self.current_instruction.y))
-            self.registers.v[self.current_instruction.x] = self.registers.v[self.current_instruction.y]
-        elif self.current_instruction.n == 1:
-            """
-            8xy1 - OR Vx, Vy
-            Set Vx = Vx OR Vy.
-            Performs a bitwise OR on the values of Vx and Vy, then stores the result in Vx.
-            A bitwise OR compares the corresponding bits from two values, and if either bit is 1,
-            then the same bit in the result is also 1. Otherwise, it is 0.
-            """
-            logger.debug("OR V{:01X}, V{:01X}".format(self.current_instruction.x, self.current_instruction.y))
-            self.registers.v[self.current_instruction.x] |= self.registers.v[self.current_instruction.y]
-        elif self.current_instruction.n == 2:
-            """
-            8xy2 - AND Vx, Vy
-            Set Vx = Vx AND Vy.
-            Performs a bitwise AND on the values of Vx and Vy, then stores the result in Vx.
-            A bitwise AND compares the corresponding bits from two values, and if both bits are 1,
-            then the same bit in the result is also 1. Otherwise, it is 0.
-            """
-            logger.debug("AND V{:01X}, V{:01X}".format(self.current_instruction.x, self.current_instruction.y))
-            self.registers.v[self.current_instruction.x] &= self.registers.v[self.current_instruction.y]
-        elif self.current_instruction.n == 3:
-            """
-            8xy3 - XOR Vx, Vy
-            Set Vx = Vx XOR Vy.
-            Performs a bitwise exclusive OR on the values of Vx and Vy, then stores the result in Vx.
-            An exclusive OR compares the corresponding bits from two values, and if the bits are not both the same,
-            then the corresponding bit in the result is set to 1. Otherwise, it is 0.
-            """
-            logger.debug("XOR V{:01X}, V{:01X}".format(self.current_instruction.x, self.current_instruction.y))
-            self.registers.v[self.current_instruction.x] ^= self.registers.v[self.current_instruction.y]
-        elif self.current_instruction.n == 4:
-            """
-            8xy4 - ADD Vx, Vy
-            Set Vx = Vx + Vy, set VF = carry.
-            The values of Vx and Vy are added together.
-            If the result is greater than 8 bits (i.e., > 255,) VF is set to 1, otherwise 0.
-            Only the lowest 8 bits of the result are kept, and stored in Vx.
-            """
-            logger.debug("ADD V{:01X}, V{:01X}".format(self.current_instruction.x, self.current_instruction.y))
-            self.registers.v[self.current_instruction.x] += self.registers.v[self.current_instruction.y]
-            if (self.registers.v[self.current_instruction.x] > 0xFF):
-                self.registers.v[0xF] = 1
-            else:
-                self.registers.v[0xF] = 0
-            self.registers.v[self.current_instruction.x] &= 0xFF # truncate to 8 bits
-        elif self.current_instruction.n == 5:
-            """
-            8xy5 - SUB Vx, Vy
-            Set Vx = Vx - Vy, set VF = NOT borrow.
-            If Vx > Vy, then VF is set to 1, otherwise 0. Then Vy is subtracted from Vx, and the results stored in Vx.
-            """
-            logger.debug("SUB V{:01X}, V{:01X}".format(self.current_instruction.x, self.current_instruction.y))
-            if self.registers.v[self.current_instruction.x] > self.registers.v[self.current_instruction.y]:
-                self.registers.v[0xF] = 1
-            else:
-                self.registers.v[0xF] = 0
-            self.registers.v[self.current_instruction.x] -= self.registers.v[self.current_instruction.y]
-            self.registers.v[self.current_instruction.x] &= 0xFF # truncate to 8 bits
-        elif self.current_instruction.n == 6:
-            """
-            8xy6 - SHR Vx {, Vy}
-            Set Vx = Vx SHR 1.
-            If the least-significant bit of Vx is 1, then VF is set to 1, otherwise 0. Then Vx is divided by 2.
-            """
-            logger.debug("SHR My V{:01X}".format(self.current_instruction.x))
-            if self.shift_Vy:
-                self.registers.v[0xF] = self.registers.v[self.current_instruction.y] & 0x01
-                self.registers.v[self.current_instruction.x]  = self.registers.v[self.current_instruction.y] >> 1
-            else:
-                self.registers.v[0xF] = self.registers.v[self.current_instruction.x] & 0x01
-                self.registers.v[self.current_instruction.x] >>= 1
-        elif self.current_instruction.n == 7:
-            """
-            8xy7 - SUBN Vx, Vy
-            Set Vx = Vy - Vx, set VF = NOT borrow.
-            If Vy > Vx, then VF is set to 1, otherwise 0.
-            Then Vx is subtracted from Vy, and the results stored in Vx.
-            """
-            logger.debug("SUBN V{:01X}, V{:01X}".format(self.current_instruction.x, self.current_instruction.y))
-            if self.registers.v[self.current_instruction.y] > self.registers.v[self.current_instruction.x]:
-                self.registers.v[0xF] = 1
-            else:
-                self.registers.v[0xF] = 0
-            self.registers.v[self.current_instruction.x] = self.registers.v[self.current_instruction.y] - self.registers.v[self.current_instruction.x]
-            self.registers.v[self.current_instruction.x] &= 0xFF # truncate to 8 bits
-        elif self.current_instruction.n == 0xe:
-            """
-            8xyE - SHL Vx {, Vy}
-            Set Vx = Vx SHL 1.
-            If the most-significant bit of Vx is 1, then VF is set to 1, otherwise to 0.
-            Then Vx is multiplied by 2.
-            """
-            logger.debug("SHL V{:01X}".format(self.current_instruction.x))
-            if self.shift_Vy:
-                self.registers.v[0xF] = 1 if (self.registers.v[self.current_instruction.y] & 0x80) else 0
-                self.registers.v[self.current_instruction.x] = self.registers.v[self.current_instruction.y] << 1
-            else:
-                self.registers.v[0xF] = 1 if(self.registers.v[self.current_instruction.x] & 0x80) else 0
-                self.registers.v[self.current_instruction.x] = self.registers.v[self.current_instruction.x] << 1
-            self.registers.v[self.current_instruction.x] &= 0xFF # truncate to 8 bits
+        """
+        8xyn - Register to register operations. Looked up by n.
+        Unknown n is ignored.
+        """
+        function = self.eight_function_map.get(self.current_instruction.n)
+        if function is not None:
+            function()
+
+    def eight_load(self):
+        """
+        8xy0 - LD Vx, Vy
+        Set Vx = Vy.
+        Stores the value of register Vy in register Vx.
+        """
+        logger.debug("LD V{:01X}, V{:01X}".format(self.current_instruction.x, self.current_instruction.y))
+        self.registers.v[self.current_instruction.x] = self.registers.v[self.current_instruction.y]
+
+    def eight_or(self):
+        """
+        8xy1 - OR Vx, Vy
+        Set Vx = Vx OR Vy.
+        Performs a bitwise OR on the values of Vx and Vy, then stores the result in Vx.
+        A bitwise OR compares the corresponding bits from two values, and if either bit is 1,
+        then the same bit in the result is also 1. Otherwise, it is 0.
+        """
+        logger.debug("OR V{:01X}, V{:01X}".format(self.current_instruction.x, self.current_instruction.y))
+        self.registers.v[self.current_instruction.x] |= self.registers.v[self.current_instruction.y]
+
+    def eight_and(self):
+        """
+        8xy2 - AND Vx, Vy
+        Set Vx = Vx AND Vy.
+        Performs a bitwise AND on the values of Vx and Vy, then stores the result in Vx.
+        A bitwise AND compares the corresponding bits from two values, and if both bits are 1,
+        then the same bit in the result is also 1. Otherwise, it is 0.
+        """
+        logger.debug("AND V{:01X}, V{:01X}".format(self.current_instruction.x, self.current_instruction.y))
+        self.registers.v[self.current_instruction.x] &= self.registers.v[self.current_instruction.y]
+
+    def eight_xor(self):
+        """
+        8xy3 - XOR Vx, Vy
+        Set Vx = Vx XOR Vy.
+        Performs a bitwise exclusive OR on the values of Vx and Vy, then stores the result in Vx.
+        An exclusive OR compares the corresponding bits from two values, and if the bits are not both the same,
+        then the corresponding bit in the result is set to 1. Otherwise, it is 0.
+        """
+        logger.debug("XOR V{:01X}, V{:01X}".format(self.current_instruction.x, self.current_instruction.y))
+        self.registers.v[self.current_instruction.x] ^= self.registers.v[self.current_instruction.y]
+
+    def eight_add(self):
+        """
+        8xy4 - ADD Vx, Vy
+        Set Vx = Vx + Vy, set VF = carry.
+        The values of Vx and Vy are added together.
+        If the result is greater than 8 bits (i.e., > 255,) VF is set to 1, otherwise 0.
+        Only the lowest 8 bits of the result are kept, and stored in Vx.
+        """
+        logger.debug("ADD V{:01X}, V{:01X}".format(self.current_instruction.x, self.current_instruction.y))
+        total = self.registers.v[self.current_instruction.x] + self.registers.v[self.current_instruction.y]
+        self.registers.v[self.current_instruction.x] = total & 0xFF # truncate to 8 bits
+        if (total > 0xFF):
+            self.registers.v[0xF] = 1
+        else:
+            self.registers.v[0xF] = 0
+
+    def eight_sub(self):
+        """
+        8xy5 - SUB Vx, Vy
+        Set Vx = Vx - Vy, set VF = NOT borrow.
+        If Vx > Vy, then VF is set to 1, otherwise 0. Then Vy is subtracted from Vx, and the results stored in Vx.
+        """
+        logger.debug("SUB V{:01X}, V{:01X}".format(self.current_instruction.x, self.current_instruction.y))
+        if self.registers.v[self.current_instruction.x] > self.registers.v[self.current_instruction.y]:
+            self.registers.v[0xF] = 1
+        else:
+            self.registers.v[0xF] = 0
+        self.registers.v[self.current_instruction.x] = (self.registers.v[self.current_instruction.x] - self.registers.v[self.current_instruction.y]) & 0xFF # truncate to 8 bits
+
+    def eight_shift_right(self):
+        """
+        8xy6 - SHR Vx {, Vy}
+        Set Vx = Vx SHR 1.
+        If the least-significant bit of Vx is 1, then VF is set to 1, otherwise 0. Then Vx is divided by 2.
+        """
+        logger.debug("SHR My V{:01X}".format(self.current_instruction.x))
+        self.registers.v[0xF] = self.registers.v[self.current_instruction.x] & 0x01
+        self.registers.v[self.current_instruction.x] >>= 1
+
+    def eight_shift_right_vy(self):
+        """
+        8xy6 - SHR Vx, Vy with shift_Vy quirk
+        Set Vx = Vy SHR 1.
+        If the least-significant bit of Vy is 1, then VF is set to 1, otherwise 0.
+        """
+        logger.debug("SHR V{:01X}, V{:01X}".format(self.current_instruction.x, self.current_instruction.y))
+        self.registers.v[0xF] = self.registers.v[self.current_instruction.y] & 0x01
+        self.registers.v[self.current_instruction.x]  = self.registers.v[self.current_instruction.y] >> 1
+
+    def eight_subn(self):
+        """
+        8xy7 - SUBN Vx, Vy
+        Set Vx = Vy - Vx, set VF = NOT borrow.
+        If Vy > Vx, then VF is set to 1, otherwise 0.
+        Then Vx is subtracted from Vy, and the results stored in Vx.
+        """
+        logger.debug("SUBN V{:01X}, V{:01X}".format(self.current_instruction.x, self.current_instruction.y))
+        if self.registers.v[self.current_instruction.y] > self.registers.v[self.current_instruction.x]:
+            self.registers.v[0xF] = 1
+        else:
+            self.registers.v[0xF] = 0
+        self.registers.v[self.current_instruction.x] = (self.registers.v[self.current_instruction.y] - self.registers.v[self.current_instruction.x]) & 0xFF # truncate to 8 bits
+
+    def eight_shift_left(self):
+        """
+        8xyE - SHL Vx {, Vy}
+        Set Vx = Vx SHL 1.
+        If the most-significant bit of Vx is 1, then VF is set to 1, otherwise to 0.
+        Then Vx is multiplied by 2.
+        """
+        logger.debug("SHL V{:01X}".format(self.current_instruction.x))
+        self.registers.v[0xF] = 1 if(self.registers.v[self.current_instruction.x] & 0x80) else 0
+        self.registers.v[self.current_instruction.x] = (self.registers.v[self.current_instruction.x] << 1) & 0xFF # truncate to 8 bits
+
+    def eight_shift_left_vy(self):
+        """
+        8xyE - SHL Vx, Vy with shift_Vy quirk
+        Set Vx = Vy SHL 1.
+        If the most-significant bit of Vy is 1, then VF is set to 1, otherwise to 0.
+        """
+        logger.debug("SHL V{:01X}, V{:01X}".format(self.current_instruction.x, self.current_instruction.y))
+        self.registers.v[0xF] = 1 if (self.registers.v[self.current_instruction.y] & 0x80) else 0
+        self.registers.v[self.current_instruction.x] = (self.registers.v[self.current_instruction.y] << 1) & 0xFF # truncate to 8 bits
 
     def nine(self):
         """
@@ -573,7 +839,7 @@ class CPU(object):
         The results are stored in Vx. See instruction 8xy2 for more information on AND.
         """
         logger.debug("RND V{:01X}, byte".format(self.current_instruction.x))
-        self.registers.v[self.current_instruction.x] = randrange(0,255) & self.current_instruction.kk
+        self.registers.v[self.current_instruction.x] = self.random.randrange(0,255) & self.current_instruction.kk
 
     def d(self):
         """
@@ -642,6 +908,7 @@ class CPU(object):
                 # if no key is pressed execute the same instruction again and again
                 # until a key is pressed
                 self.program_counter -= 2 # account for +2 at end of cycle
+                self.waiting_for_key = True
 
         elif self.current_instruction.kk == 0x15:
             """
@@ -712,6 +979,35 @@ class CPU(object):
                 self.registers.v[index] &= 0xFF
             # self.registers.i += (self.current_instruction.x + 1)
 
+    # Scalar registers returned by status(). stack_pointer is stack_depth(), 0 when nothing was called.
+    Status = namedtuple('Status', 'program_counter i delay_timer sound_timer stack_pointer')
+
+    class StateViews(object):
+        def __init__(self, memory, v, display_buffer):
+            """
+            Read-only memoryviews returned by CPU.inspect
+            :param memory: 4096 bytes of memory
+            :param v: 16 V registers
+            :param display_buffer: one byte per pixel, row major
+            """
+            self.memory = memory
+            self.v = v
+            self.display_buffer = display_buffer
+
+    class Frame(object):
+        def __init__(self, number, display_buffer, changed_rows, sound):
+            """
+            One frame yielded by CPU.frames
+            :param number: frame number, starting from 1
+            :param display_buffer: bytes, one byte per pixel. None for deltas.
+            :param changed_rows: list of (row, bytes of row) changed since previous frame. None for snapshots.
+            :param sound: True if sound timer is active
+            """
+            self.number = number
+            self.display_buffer = display_buffer
+            self.changed_rows = changed_rows
+            self.sound = sound
+
     class CurrentInstruction(object):
         def __init__(self, opcode=0):
             self.opcode = opcode
@@ -731,7 +1027,13 @@ class CPU(object):
 
     class Registers(object):
         def __init__(self):
-            self.v = [0] * 16
+            self.v = bytearray(16)
+            self.i = 0
+            self.delay_timer = 0
+            self.sound_timer = 0
+
+        def clear(self):
+            self.v[:] = bytes(16)
             self.i = 0
             self.delay_timer = 0
             self.sound_timer = 0
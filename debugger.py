@@ -0,0 +1,474 @@
+__author__ = 'jaya'
+
+# External imports
+import cmd
+import operator
+import re
+import sys
+
+# Local imports
+from log import create_logger
+from disassembler import disassemble, disassemble_memory
+
+# Setup logger
+logger = create_logger(__name__)
+
+# Set logging level
+DEBUG = 10
+NOTSET = 0
+logger.setLevel(NOTSET)
+
+CONDITION_OPERATORS = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<=': operator.le,
+    '>=': operator.ge,
+    '<': operator.lt,
+    '>': operator.gt
+}
+CONDITION_PATTERN = re.compile(r'^\s*(V[0-9A-F]|I|DT|ST)\s*(==|!=|<=|>=|<|>)\s*(0x[0-9A-F]+|\d+)\s*$', re.IGNORECASE)
+
+def compile_condition(condition):
+    """
+    Compile condition string like "V3 == 0x10" or "I > 0x300" to a function.
+    Supported operands are V0-VF, I, DT and ST.
+    :param condition: condition string
+    :return: function taking CPU object and returning True if condition is met
+    """
+    match = CONDITION_PATTERN.match(condition)
+    if not match:
+        raise ValueError("Invalid condition '{}'. Expected like 'V3 == 0x10' or 'I > 0x300'".format(condition))
+    operand, compare, value = match.groups()
+    operand = operand.upper()
+    compare = CONDITION_OPERATORS[compare]
+    value = int(value, 0)
+    if operand == 'I':
+        return lambda cpu: compare(cpu.registers.i, value)
+    elif operand == 'DT':
+        return lambda cpu: compare(cpu.registers.delay_timer, value)
+    elif operand == 'ST':
+        return lambda cpu: compare(cpu.registers.sound_timer, value)
+    index = int(operand[1], 16)
+    return lambda cpu: compare(cpu.registers.v[index], value)
+
+def memory_access(cpu, opcode):
+    """
+    Find memory range read or written by given opcode when executed with current registers.
+    :param cpu: CPU object
+    :param opcode: opcode about to be executed
+    :return: tuple (mode, start, end) where mode is 'r' or 'w'. None if opcode does not access memory.
+    """
+    lookup_opcode = opcode >> 12
+    if lookup_opcode == 0xD:
+        return 'r', cpu.registers.i, cpu.registers.i + (opcode & 0x000f)
+    if lookup_opcode == 0xF:
+        kk = opcode & 0x00ff
+        x = (opcode & 0x0f00) >> 8
+        if kk == 0x33:
+            return 'w', cpu.registers.i, cpu.registers.i + 3
+        if kk == 0x55:
+            return 'w', cpu.registers.i, cpu.registers.i + x + 1
+        if kk == 0x65:
+            return 'r', cpu.registers.i, cpu.registers.i + x + 1
+    return None
+
+
+class Debugger(object):
+    def __init__(self, cpu):
+        """
+        Breakpoints, watchpoints and stepping for given CPU.
+        Checks are done in a separate execute_one_instruction which is swapped in
+        only while at least one breakpoint or watchpoint is set, so CPU runs at
+        normal speed otherwise. While checks are on, instructions are executed
+        one at a time by the reference engine, so breakpoints inside fused
+        sequences are hit too.
+        :param cpu: CPU object
+        """
+        self.cpu = cpu
+        self.breakpoints = dict()  # address -> (condition string, compiled condition)
+        self.conditions = dict()  # condition string -> compiled condition, checked at every address
+        self.watchpoints = dict()  # (start, end) -> mode
+        self.break_reason = None
+        self.engine = None
+        self.saved_engine = dict()
+
+    def add_breakpoint(self, address, condition=None):
+        """
+        Stop before executing instruction at given address.
+        :param address: program counter value
+        :param condition: optional condition string. See compile_condition.
+        :return: None
+        """
+        compiled = compile_condition(condition) if condition else None
+        self.breakpoints[address] = (condition, compiled)
+        self.update_dispatch()
+
+    def remove_breakpoint(self, address):
+        self.breakpoints.pop(address, None)
+        self.update_dispatch()
+
+    def add_condition(self, condition):
+        """
+        Stop before any instruction when condition is met.
+        :param condition: condition string. See compile_condition.
+        :return: None
+        """
+        self.conditions[condition] = compile_condition(condition)
+        self.update_dispatch()
+
+    def remove_condition(self, condition):
+        self.conditions.pop(condition, None)
+        self.update_dispatch()
+
+    def add_watchpoint(self, address, length=1, mode='rw'):
+        """
+        Stop before an instruction reads or writes given memory range.
+        :param address: start address in memory_buffer
+        :param length: number of bytes to watch
+        :param mode: 'r', 'w' or 'rw'
+        :return: None
+        """
+        if not mode or set(mode) - set('rw'):
+            raise ValueError("Invalid watchpoint mode '{}'. Expected 'r', 'w' or 'rw'".format(mode))
+        self.watchpoints[(address, address + length)] = mode
+        self.update_dispatch()
+
+    def remove_watchpoint(self, address):
+        for key in [key for key in self.watchpoints if key[0] == address]:
+            del self.watchpoints[key]
+        self.update_dispatch()
+
+    def clear(self):
+        """
+        Remove all breakpoints, conditions and watchpoints
+        :return: None
+        """
+        self.breakpoints.clear()
+        self.conditions.clear()
+        self.watchpoints.clear()
+        self.update_dispatch()
+
+    def update_dispatch(self):
+        """
+        Swap CPU's execute_one_instruction with the checking version when
+        anything is set, and restore the original one when nothing is set.
+        :return: None
+        """
+        active = bool(self.breakpoints or self.conditions or self.watchpoints)
+        if active and self.engine is None:
+            self.install_checks()
+        elif not active and self.engine is not None:
+            self.remove_checks()
+
+    def install_checks(self):
+        """
+        Put checking execute_one_instruction in place. Overrides of the current
+        engine are saved and the reference engine runs instructions meanwhile.
+        :return: None
+        """
+        cpu = self.cpu
+        for name in ('execute_one_instruction', 'run_frame'):
+            if name in cpu.__dict__:
+                self.saved_engine[name] = cpu.__dict__.pop(name)
+        self.engine = cpu.execute_one_instruction
+        cpu.execute_one_instruction = self.execute_one_instruction
+        logger.debug("Debugger checks enabled")
+
+    def remove_checks(self):
+        """
+        Restore execute_one_instruction and run_frame of the engine saved by install_checks
+        :return: None
+        """
+        cpu = self.cpu
+        cpu.__dict__.pop('execute_one_instruction', None)
+        cpu.__dict__.update(self.saved_engine)
+        self.engine = None
+        self.saved_engine.clear()
+        logger.debug("Debugger checks disabled")
+
+    def check(self):
+        """
+        Check breakpoints and watchpoints for the instruction at program counter.
+        :return: Reason string if execution should stop, else None
+        """
+        cpu = self.cpu
+        address = cpu.program_counter
+        if address in self.breakpoints:
+            condition, compiled = self.breakpoints[address]
+            if compiled is None:
+                return "Breakpoint at 0x{:03X}".format(address)
+            if compiled(cpu):
+                return "Breakpoint at 0x{:03X} ({})".format(address, condition)
+        for condition, compiled in self.conditions.items():
+            if compiled(cpu):
+                return "Condition {} at 0x{:03X}".format(condition, address)
+        if self.watchpoints and address < cpu.total_memory - 1:
+            opcode = (cpu.memory_buffer[address] << 8) | cpu.memory_buffer[address + 1]
+            access = memory_access(cpu, opcode)
+            if access:
+                mode, start, end = access
+                for (watch_start, watch_end), watch_mode in self.watchpoints.items():
+                    if mode in watch_mode and start < watch_end and watch_start < end:
+                        return "Watchpoint {} 0x{:03X}-0x{:03X} by {} at 0x{:03X}".format(
+                            'read' if mode == 'r' else 'write', max(start, watch_start),
+                            min(end, watch_end) - 1, disassemble(opcode), address)
+        return None
+
+    def execute_one_instruction(self):
+        """
+        Execute one instruction unless a breakpoint or watchpoint is hit.
+        :return: None
+        """
+        reason = self.check()
+        if reason:
+            self.break_reason = reason
+            return
+        self.engine()
+
+    def execute_unchecked(self):
+        """
+        Execute one instruction without checking breakpoints
+        :return: None
+        """
+        if self.engine is not None:
+            self.engine()
+        else:
+            self.cpu.execute_one_instruction()
+
+    def step(self, count=1):
+        """
+        Execute count instructions. Breakpoints are ignored for the first one.
+        :param count: number of instructions to execute
+        :return: Reason string if stopped early, else None
+        """
+        self.break_reason = None
+        for index in range(count):
+            if not self.cpu.is_running:
+                return "Program reached end"
+            if index > 0:
+                reason = self.check()
+                if reason:
+                    return reason
+            self.execute_unchecked()
+        return None
+
+    def step_over(self):
+        """
+        Execute one instruction. Subroutine calls are executed till they return.
+        :return: Reason string if stopped inside the subroutine, else None
+        """
+        cpu = self.cpu
+        address = cpu.program_counter
+        opcode = (cpu.memory_buffer[address] << 8) | cpu.memory_buffer[address + 1]
+        if opcode & 0xf000 != 0x2000:
+            return self.step()
+        depth = len(cpu.stack)
+        self.step()
+        return self.run(until=lambda: cpu.program_counter == address + 2 and len(cpu.stack) == depth)
+
+    def resume(self):
+        """
+        Continue execution until a breakpoint or watchpoint is hit or program ends.
+        Instruction at current address is executed even if it has a breakpoint.
+        :return: Reason why execution stopped
+        """
+        if not self.cpu.is_running:
+            return "Program reached end"
+        self.break_reason = None
+        self.execute_unchecked()
+        return self.run()
+
+    def run(self, until=None):
+        """
+        Execute instructions until a breakpoint or watchpoint is hit, program ends
+        or until() returns True.
+        :param until: optional function checked before each instruction
+        :return: Reason why execution stopped. None if stopped by until.
+        """
+        cpu = self.cpu
+        self.break_reason = None
+        try:
+            while cpu.is_running and self.break_reason is None:
+                if until is not None and until():
+                    return None
+                cpu.execute_one_instruction()
+        except KeyboardInterrupt:
+            return "Interrupted at 0x{:03X}".format(cpu.program_counter)
+        if self.break_reason is not None:
+            return self.break_reason
+        return "Program reached end"
+
+
+class DebuggerConsole(cmd.Cmd):
+    intro = "CHIP-8 debugger. Type help or ? to list commands."
+    prompt = "(chip8) "
+
+    def __init__(self, cpu):
+        """
+        Interactive console for CPU debugger.
+        :param cpu: initialized CPU object
+        """
+        cmd.Cmd.__init__(self)
+        self.cpu = cpu
+        self.debugger = cpu.get_debugger()
+
+    def current_line(self):
+        address, opcode, mnemonic = disassemble_memory(self.cpu.memory_buffer, self.cpu.program_counter, 1)[0]
+        return "0x{:03X}: {:04X}  {}".format(address, opcode, mnemonic)
+
+    def report(self, reason):
+        if reason:
+            print(reason)
+        print(self.current_line())
+
+    def emptyline(self):
+        pass
+
+    def do_break(self, arg):
+        """break ADDR [CONDITION] - stop at ADDR, optionally only when CONDITION like 'V3 == 0x10' holds"""
+        parts = arg.split(None, 1)
+        if not parts:
+            print("USAGE: break ADDR [CONDITION]")
+            return
+        try:
+            self.debugger.add_breakpoint(int(parts[0], 0), parts[1] if len(parts) > 1 else None)
+        except ValueError as error:
+            print(error)
+
+    def do_delete(self, arg):
+        """delete ADDR - remove breakpoint at ADDR"""
+        try:
+            self.debugger.remove_breakpoint(int(arg, 0))
+        except ValueError as error:
+            print(error)
+
+    def do_when(self, arg):
+        """when CONDITION - stop at any address when CONDITION like 'I > 0x300' holds"""
+        try:
+            self.debugger.add_condition(arg)
+        except ValueError as error:
+            print(error)
+
+    def do_unwhen(self, arg):
+        """unwhen CONDITION - remove condition"""
+        self.debugger.remove_condition(arg)
+
+    def do_watch(self, arg):
+        """watch ADDR [LENGTH] [r|w|rw] - stop before memory at ADDR is read or written"""
+        parts = arg.split()
+        try:
+            address = int(parts[0], 0)
+            length = int(parts[1], 0) if len(parts) > 1 else 1
+            mode = parts[2] if len(parts) > 2 else 'rw'
+            self.debugger.add_watchpoint(address, length, mode)
+        except (IndexError, ValueError) as error:
+            print(error if str(error) else "USAGE: watch ADDR [LENGTH] [r|w|rw]")
+
+    def do_unwatch(self, arg):
+        """unwatch ADDR - remove watchpoints starting at ADDR"""
+        try:
+            self.debugger.remove_watchpoint(int(arg, 0))
+        except ValueError as error:
+            print(error)
+
+    def do_info(self, arg):
+        """info - list breakpoints, conditions and watchpoints"""
+        for address, (condition, _) in sorted(self.debugger.breakpoints.items()):
+            print("Breakpoint 0x{:03X}{}".format(address, " if " + condition if condition else ""))
+        for condition in self.debugger.conditions:
+            print("Condition {}".format(condition))
+        for (start, end), mode in sorted(self.debugger.watchpoints.items()):
+            print("Watchpoint 0x{:03X}-0x{:03X} {}".format(start, end - 1, mode))
+
+    def do_step(self, arg):
+        """step [N] - execute N instructions (default 1)"""
+        try:
+            count = int(arg, 0) if arg else 1
+        except ValueError:
+            print("USAGE: step [N]")
+            return
+        self.report(self.debugger.step(count))
+
+    def do_next(self, arg):
+        """next - execute one instruction, running subroutine calls till they return"""
+        self.report(self.debugger.step_over())
+
+    def do_continue(self, arg):
+        """continue - run until a breakpoint or watchpoint is hit. Ctrl-C to interrupt"""
+        self.report(self.debugger.resume())
+
+    def do_regs(self, arg):
+        """regs - print registers, stack and timers"""
+        print(self.cpu.get_debug_data().strip())
+
+    def do_mem(self, arg):
+        """mem ADDR [LENGTH] - dump memory"""
+        parts = arg.split()
+        try:
+            address = int(parts[0], 0)
+            length = int(parts[1], 0) if len(parts) > 1 else 16
+        except (IndexError, ValueError):
+            print("USAGE: mem ADDR [LENGTH]")
+            return
+        data = self.cpu.read_n_bytes_from_memory(address, length)
+        for offset in range(0, len(data), 16):
+            print("0x{:03X}: {}".format(address + offset, ' '.join("{:02X}".format(byte) for byte in data[offset: offset + 16])))
+
+    def do_list(self, arg):
+        """list [ADDR] [COUNT] - disassemble COUNT instructions from ADDR (default program counter)"""
+        parts = arg.split()
+        try:
+            address = int(parts[0], 0) if parts else self.cpu.program_counter
+            count = int(parts[1], 0) if len(parts) > 1 else 10
+        except ValueError:
+            print("USAGE: list [ADDR] [COUNT]")
+            return
+        for address, opcode, mnemonic in disassemble_memory(self.cpu.memory_buffer, address, count):
+            marker = '>' if address == self.cpu.program_counter else ' '
+            print("{} 0x{:03X}: {:04X}  {}".format(marker, address, opcode, mnemonic))
+
+    def do_screen(self, arg):
+        """screen - print display buffer"""
+        print(self.cpu.screen.get_debug_data())
+
+    def do_key(self, arg):
+        """key HEX [up|down] - press or release CHIP-8 key HEX"""
+        parts = arg.split()
+        try:
+            key = int(parts[0], 16)
+            self.cpu.keys_pressed[key] = 0 if len(parts) > 1 and parts[1] == 'up' else 1
+        except (IndexError, ValueError):
+            print("USAGE: key HEX [up|down]")
+
+    def do_reset(self, arg):
+        """reset [ROM] - reload current or given ROM. Breakpoints are kept"""
+        try:
+            self.cpu.reset(arg or None)
+        except Exception as error:
+            # CPU is unchanged when the ROM can not be read or is not valid
+            print(error)
+            return
+        self.report(None)
+
+    def do_quit(self, arg):
+        """quit - exit debugger"""
+        return True
+
+    do_b = do_break
+    do_s = do_step
+    do_n = do_next
+    do_c = do_continue
+    do_q = do_quit
+    do_EOF = do_quit
+
+if __name__ == '__main__':
+    if len(sys.argv) == 2:
+        from cpu import CPU
+        from display import Chip8Screen
+        chip8_cpu = CPU(binary=sys.argv[1], screen=Chip8Screen(), sound=None)
+        chip8_cpu.initialize_cpu()
+        console = DebuggerConsole(chip8_cpu)
+        console.intro += "\n" + console.current_line()
+        console.cmdloop()
+    else:
+        print("USAGE: debugger.py <ROM_PATH>")
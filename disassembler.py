@@ -0,0 +1,86 @@
+__author__ = 'jaya'
+
+# Mnemonics follow Cowgod's Chip-8 Technical Reference, same as CPU debug logs.
+F_MNEMONICS = {
+    0x07: "LD V{x:01X}, DT",
+    0x0A: "LD V{x:01X}, K",
+    0x15: "LD DT, V{x:01X}",
+    0x18: "LD ST, V{x:01X}",
+    0x1E: "ADD I, V{x:01X}",
+    0x29: "LD F, V{x:01X}",
+    0x33: "LD B, V{x:01X}",
+    0x55: "LD [I], V{x:01X}",
+    0x65: "LD V{x:01X}, [I]"
+}
+EIGHT_MNEMONICS = {
+    0x0: "LD V{x:01X}, V{y:01X}",
+    0x1: "OR V{x:01X}, V{y:01X}",
+    0x2: "AND V{x:01X}, V{y:01X}",
+    0x3: "XOR V{x:01X}, V{y:01X}",
+    0x4: "ADD V{x:01X}, V{y:01X}",
+    0x5: "SUB V{x:01X}, V{y:01X}",
+    0x6: "SHR V{x:01X} {{, V{y:01X}}}",
+    0x7: "SUBN V{x:01X}, V{y:01X}",
+    0xE: "SHL V{x:01X} {{, V{y:01X}}}"
+}
+MNEMONICS = {
+    0x1: "JP 0x{nnn:03X}",
+    0x2: "CALL 0x{nnn:03X}",
+    0x3: "SE V{x:01X}, 0x{kk:02X}",
+    0x4: "SNE V{x:01X}, 0x{kk:02X}",
+    0x5: "SE V{x:01X}, V{y:01X}",
+    0x6: "LD V{x:01X}, 0x{kk:02X}",
+    0x7: "ADD V{x:01X}, 0x{kk:02X}",
+    0x9: "SNE V{x:01X}, V{y:01X}",
+    0xA: "LD I, 0x{nnn:03X}",
+    0xB: "JP V0, 0x{nnn:03X}",
+    0xC: "RND V{x:01X}, 0x{kk:02X}",
+    0xD: "DRW V{x:01X}, V{y:01X}, 0x{n:01X}"
+}
+
+def disassemble(opcode):
+    """
+    Convert opcode to assembly mnemonic.
+    Example: 0xA22A will be converted to "LD I, 0x22A"
+    :param opcode: 2 byte opcode
+    :return: mnemonic string. Unknown opcodes are returned as "DW 0xXXXX"
+    """
+    fields = {
+        'x': (opcode & 0x0f00) >> 8,
+        'y': (opcode & 0x00f0) >> 4,
+        'kk': opcode & 0x00ff,
+        'nnn': opcode & 0x0fff,
+        'n': opcode & 0x000f
+    }
+    lookup_opcode = (opcode & 0xf000) >> 12
+    if opcode == 0x00E0:
+        template = "CLS"
+    elif opcode == 0x00EE:
+        template = "RET"
+    elif lookup_opcode == 0x0:
+        template = "SYS 0x{nnn:03X}"
+    elif lookup_opcode == 0x8:
+        template = EIGHT_MNEMONICS.get(fields['n'])
+    elif lookup_opcode == 0xE:
+        template = {0x9E: "SKP V{x:01X}", 0xA1: "SKNP V{x:01X}"}.get(fields['kk'])
+    elif lookup_opcode == 0xF:
+        template = F_MNEMONICS.get(fields['kk'])
+    else:
+        template = MNEMONICS[lookup_opcode]
+    if template is None:
+        return "DW 0x{:04X}".format(opcode)
+    return template.format(**fields)
+
+def disassemble_memory(memory, start, count):
+    """
+    Disassemble count instructions from memory starting at given address
+    :param memory: bytearray containing program
+    :param start: address of first instruction
+    :param count: number of instructions
+    :return: list of (address, opcode, mnemonic) tuples
+    """
+    return_list = list()
+    for address in range(start, min(start + count * 2, len(memory) - 1), 2):
+        opcode = (memory[address] << 8) | memory[address + 1]
+        return_list.append((address, opcode, disassemble(opcode)))
+    return return_list
@@ -1,17 +1,18 @@
 __author__ = 'jaya'
 
 # External Imports
-from pygame import display, Color, Rect, draw
 import os
 
 # Constants
 DEFAULT_HEIGHT = 32
 DEFAULT_WIDTH = 64
 DEFAULT_SCALE = 10
-LIGHT_GREEN = Color(0x99, 0xBD, 0x2A)
-DARK_GREEN = Color(0x2F, 0x63, 0x33)
-WHITE = Color(0xFF, 0xFF, 0xFF)
-BLACK = Color(0x00, 0x00, 0x00)
+# Colours are plain RGB tuples so that pygame is only imported
+# when a pygame window is actually created.
+LIGHT_GREEN = (0x99, 0xBD, 0x2A)
+DARK_GREEN = (0x2F, 0x63, 0x33)
+WHITE = (0xFF, 0xFF, 0xFF)
+BLACK = (0x00, 0x00, 0x00)
 BACKGROUND_COLOR = WHITE
 FOREGROUND_COLOR = BLACK
 COLOURS_MAP = {
@@ -33,14 +34,21 @@ class Chip8Screen(object):
         self.width = width
         self.scale = scale
         self.window = None
-        self.display_buffer = [0]*width*height
+        self.display = None
+        self.display_buffer = bytearray(width*height)
         self.needs_screen_update = False
+        # text drawn over top left corner of the frame, like telemetry, or None
+        self.overlay_text = None
+        self.font = None
 
     def initialize_display(self):
         """
-        Initialize pygame display.
+        Initialize pygame display. Pygame is imported here, so
+        headless and console users never pay for it.
         :return: None
         """
+        from pygame import display
+        self.display = display
         display.init()
         width = self.width * self.scale
         height = self.height * self.scale
@@ -55,8 +63,7 @@ class Chip8Screen(object):
         Clear display buffer
         :return: None
         """
-        for i in range(len(self.display_buffer)):
-            self.display_buffer[i] = 0
+        self.display_buffer[:] = bytes(len(self.display_buffer))
         self.needs_screen_update = True
 
     def clear_screen(self):
@@ -71,7 +78,7 @@ class Chip8Screen(object):
         Update pygame display
         :return: None
         """
-        display.flip()
+        self.display.flip()
 
     def save_pixel(self, x, y, pixel_color):
         """
@@ -108,12 +115,33 @@ class Chip8Screen(object):
                 y_pos = y * self.scale
                 # Skip 0(background color) as we are already clearing screen at beginning.
                 if self.display_buffer[counter]:
-                    pixel = Rect(x_pos, y_pos, self.scale, self.scale)
-                    draw.rect(self.window, COLOURS_MAP['foreground_color'], pixel)
+                    pixel = (x_pos, y_pos, self.scale, self.scale)
+                    self.window.fill(COLOURS_MAP['foreground_color'], pixel)
                 counter += 1
+        if self.overlay_text:
+            self.draw_overlay()
         self.update_display()
         self.needs_screen_update = False
 
+    def draw_overlay(self):
+        """
+        Draw overlay text on pygame window
+        :return: None
+        """
+        if self.font is None:
+            from pygame import font
+            font.init()
+            self.font = font.Font(None, 20)
+        text = self.font.render(self.overlay_text, True, COLOURS_MAP['background_color'], COLOURS_MAP['foreground_color'])
+        self.window.blit(text, (0, 0))
+
+    def mark_frame_drawn(self):
+        """
+        Mark display buffer as drawn without rendering it. Used when there is no window.
+        :return: None
+        """
+        self.needs_screen_update = False
+
     def draw_frame_to_console(self):
         """
         Dumps display buffer to console.
@@ -128,6 +156,8 @@ class Chip8Screen(object):
                 line += colour
                 counter += 1
             print(line)
+        if self.overlay_text:
+            print(self.overlay_text)
         self.needs_screen_update = False
 
     def get_debug_data(self):
@@ -161,4 +191,5 @@ class Chip8Screen(object):
         destroy pygame display
         :return:
         """
-        display.quit()
+        if self.display is not None:
+            self.display.quit()
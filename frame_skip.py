@@ -0,0 +1,62 @@
+__author__ = 'jaya'
+
+# External imports
+import time
+
+# Local imports
+from log import create_logger
+
+# Setup logger
+logger = create_logger(__name__)
+
+# Set logging level
+DEBUG = 10
+NOTSET = 0
+logger.setLevel(NOTSET)
+
+# Constants
+DEFAULT_MAX_SKIP = 4  # frames skipped in a row before one is drawn anyway
+SMOOTHING = 0.2  # weight of newest measurement in render cost average
+
+class FrameSkipper(object):
+    def __init__(self, max_skip=DEFAULT_MAX_SKIP, smoothing=SMOOTHING):
+        """
+        Adaptive render decimation. Keeps a moving average of draw time and
+        skips drawing a frame when it would not finish before the frame deadline.
+        Emulation is not skipped, only presenting. Skipping stops by itself when
+        drawing gets cheap again, as every (max_skip + 1)th frame is drawn and measured.
+        :param max_skip: most frames skipped in a row
+        :param smoothing: weight of newest draw time in moving average
+        """
+        self.max_skip = max_skip
+        self.smoothing = smoothing
+        self.render_cost = 0.0
+        self.skipped_frames = 0
+        self.consecutive_skips = 0
+
+    def should_present(self, deadline):
+        """
+        Decide if current frame is drawn. Call only for frames that need drawing.
+        :param deadline: time.perf_counter() value the frame must be finished by
+        :return: True to draw, False to skip
+        """
+        if self.consecutive_skips >= self.max_skip or time.perf_counter() + self.render_cost <= deadline:
+            return True
+        self.consecutive_skips += 1
+        self.skipped_frames += 1
+        return False
+
+    def present(self, draw_frame):
+        """
+        Draw frame and measure how long it took
+        :param draw_frame: function drawing the frame
+        :return: None
+        """
+        start = time.perf_counter()
+        draw_frame()
+        render_time = time.perf_counter() - start
+        self.render_cost += self.smoothing * (render_time - self.render_cost)
+        if self.consecutive_skips:
+            logger.debug("Drew frame after skipping {}. Render cost {:.2f} ms".format(
+                self.consecutive_skips, self.render_cost * 1000))
+        self.consecutive_skips = 0
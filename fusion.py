@@ -0,0 +1,254 @@
+__author__ = 'jaya'
+
+# External imports
+import argparse
+import time
+
+# Local imports
+from log import create_logger
+
+# Setup logger
+logger = create_logger(__name__)
+
+# Set logging level
+DEBUG = 10
+NOTSET = 0
+logger.setLevel(NOTSET)
+
+
+class FusedInstruction(object):
+    def __init__(self, kind, handler, code):
+        """
+        Sequence of instructions executed by a single handler.
+        :param kind: name of the fused pattern
+        :param handler: function executing the sequence and updating program counter.
+                        Returns number of instructions it executed.
+        :param code: original bytes of the sequence, to detect overwritten code
+        """
+        self.kind = kind
+        self.handler = handler
+        self.code = code
+        self.length = len(code) // 2
+
+
+def fuse_load_i_draw(cpu, nnn, x, y, n):
+    """
+    Annn, Dxyn - LD I, addr then DRW Vx, Vy, nibble
+    """
+    def handler():
+        registers = cpu.registers
+        registers.i = nnn
+        cpu.save_sprite_to_display_buffer(registers.v[x], registers.v[y], cpu.memory_buffer[nnn: nnn + n])
+        cpu.program_counter += 4
+        return 2
+    return handler
+
+def fuse_skip_jump(cpu, x, kk, skip_if_equal, nnn):
+    """
+    3xkk/4xkk, 1nnn - SE/SNE Vx, byte then JP addr
+    Skipping the jump executes only one instruction.
+    """
+    def handler():
+        if (cpu.registers.v[x] == kk) == skip_if_equal:
+            cpu.program_counter += 4
+            return 1
+        cpu.program_counter = nnn
+        return 2
+    return handler
+
+def fuse_load_run(cpu, loads):
+    """
+    6xkk, 6xkk, ... - run of LD Vx, byte
+    """
+    size = len(loads) * 2
+    def handler():
+        v = cpu.registers.v
+        for x, kk in loads:
+            v[x] = kk
+        cpu.program_counter += size
+        return len(loads)
+    return handler
+
+def fuse_timer_poll(cpu, timer_x, x, kk, skip_if_equal, nnn):
+    """
+    Fx07, 3xkk/4xkk, 1nnn - LD Vx, DT then SE/SNE Vx, byte then JP addr
+    Skipping the jump executes only two instructions.
+    """
+    def handler():
+        registers = cpu.registers
+        registers.v[timer_x] = registers.delay_timer
+        if (registers.v[x] == kk) == skip_if_equal:
+            cpu.program_counter += 6
+            return 2
+        cpu.program_counter = nnn
+        return 3
+    return handler
+
+
+class FusedEngine(object):
+    def __init__(self, cpu):
+        """
+        Execution engine which runs common instruction sequences as one dispatch.
+        A peephole pass over the loaded program finds the sequences. Each fused
+        entry keeps its original bytes and is dropped when memory no longer
+        matches them, so overwritten code falls back to single instructions.
+        Other instructions are executed by CPU.execute_one_instruction.
+        :param cpu: CPU object
+        """
+        self.cpu = cpu
+        self.reference = type(cpu).execute_one_instruction.__get__(cpu)
+        self.table = dict()  # address -> FusedInstruction
+        self.fused_instructions_executed = 0
+
+    def load_program(self):
+        """
+        Scan program in memory and build fused entries.
+        :return: None
+        """
+        cpu = self.cpu
+        memory = cpu.memory_buffer
+        end = cpu.program_end_point
+        # only fuse code found by static analysis, if there is one
+        code = cpu.analysis.instructions if cpu.analysis is not None else None
+        self.table.clear()
+        opcodes = [(memory[address] << 8) | memory[address + 1] for address in range(0x200, end - 1, 2)]
+        for index in range(len(opcodes)):
+            address = 0x200 + index * 2
+            if code is not None and address not in code:
+                continue
+            entry = self.match(opcodes, index)
+            if entry is not None:
+                kind, handler, length = entry
+                self.table[address] = FusedInstruction(kind, handler, bytes(memory[address: address + length * 2]))
+        logger.debug("Fused {} instruction sequences".format(len(self.table)))
+
+    def match(self, opcodes, index):
+        """
+        Find fusable sequence starting at opcodes[index]
+        :param opcodes: list of program opcodes
+        :param index: index of first opcode
+        :return: tuple (kind, handler, number of instructions) or None
+        """
+        cpu = self.cpu
+        first = opcodes[index]
+        second = opcodes[index + 1] if index + 1 < len(opcodes) else None
+        third = opcodes[index + 2] if index + 2 < len(opcodes) else None
+        if second is None:
+            return None
+        if (first & 0xf0ff) == 0xf007 and third is not None and (second >> 12) in (0x3, 0x4) and (third >> 12) == 0x1:
+            return ('timer_poll', fuse_timer_poll(cpu, (first & 0x0f00) >> 8, (second & 0x0f00) >> 8, second & 0x00ff,
+                                                  (second >> 12) == 0x3, third & 0x0fff), 3)
+        if (first >> 12) in (0x3, 0x4) and (second >> 12) == 0x1:
+            return ('skip_jump', fuse_skip_jump(cpu, (first & 0x0f00) >> 8, first & 0x00ff,
+                                                (first >> 12) == 0x3, second & 0x0fff), 2)
+        if (first >> 12) == 0xA and (second >> 12) == 0xD:
+            return ('load_i_draw', fuse_load_i_draw(cpu, first & 0x0fff, (second & 0x0f00) >> 8,
+                                                    (second & 0x00f0) >> 4, second & 0x000f), 2)
+        if (first >> 12) == 0x6 and (second >> 12) == 0x6:
+            loads = list()
+            for opcode in opcodes[index:]:
+                if (opcode >> 12) != 0x6:
+                    break
+                loads.append(((opcode & 0x0f00) >> 8, opcode & 0x00ff))
+            return ('load_run', fuse_load_run(cpu, tuple(loads)), len(loads))
+        return None
+
+    def lookup(self, address):
+        """
+        Get fused entry at address if code there is unchanged. Entries of
+        overwritten code are removed.
+        :param address: program counter
+        :return: FusedInstruction or None
+        """
+        entry = self.table.get(address)
+        if entry is not None and self.cpu.memory_buffer[address: address + len(entry.code)] != entry.code:
+            logger.debug("Code at 0x{:03X} was overwritten. Removing fused entry".format(address))
+            del self.table[address]
+            return None
+        return entry
+
+    def execute_one_instruction(self):
+        """
+        Execute fused sequence at program counter, or one instruction if there is none.
+        :return: None
+        """
+        cpu = self.cpu
+        entry = self.lookup(cpu.program_counter)
+        if entry is None:
+            self.reference()
+            return
+        self.fused_instructions_executed += entry.handler()
+        if cpu.realtime_timers:
+            cpu.update_realtime_timers()
+
+    def run_frame(self, instructions_per_frame):
+        """
+        Same as CPU.run_frame. Fused sequences count as the number of
+        instructions they executed, and are not used if they might not fit in the frame.
+        :param instructions_per_frame: number of instructions to execute
+        :return: number of instructions executed
+        """
+        cpu = self.cpu
+        remaining = instructions_per_frame
+        cpu.waiting_for_key = False
+        while remaining > 0 and cpu.is_running:
+            entry = self.lookup(cpu.program_counter)
+            if entry is None or entry.length > remaining:
+                self.reference()
+                if cpu.waiting_for_key:
+                    break
+                remaining -= 1
+                continue
+            executed = entry.handler()
+            self.fused_instructions_executed += executed
+            remaining -= executed
+            if cpu.realtime_timers:
+                cpu.update_realtime_timers()
+        if not cpu.realtime_timers:
+            cpu.tick_timers()
+        return instructions_per_frame - remaining
+
+def benchmark(rom, frames, instructions_per_frame, repeat):
+    """
+    Run ROM headless on reference and fused engines and report fusion rate and speedup.
+    :return: None
+    """
+    from cpu import CPU
+    from display import Chip8Screen
+    timings = dict()
+    for engine in ('reference', 'fused'):
+        best = None
+        for _ in range(repeat):
+            cpu = CPU(binary=rom, screen=Chip8Screen(), sound=None)
+            cpu.random.seed(0)
+            cpu.realtime_timers = False
+            cpu.set_engine(engine)
+            cpu.initialize_cpu()
+            # frames end early while waiting for a key, so count what was executed
+            executed = 0
+            start = time.perf_counter()
+            for _ in range(frames):
+                executed += cpu.run_frame(instructions_per_frame)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        timings[engine] = best
+    kinds = dict()
+    for entry in cpu.engine.table.values():
+        kinds[entry.kind] = kinds.get(entry.kind, 0) + 1
+    total = executed  # of the last fused run, same program and seed as the others
+    print("{}: {} fused entries ({})".format(rom, len(cpu.engine.table),
+                                             ', '.join("{} {}".format(kinds[kind], kind) for kind in sorted(kinds))))
+    print("    fusion rate: {:.1f}% of {} executed instructions".format(
+        100.0 * cpu.engine.fused_instructions_executed / total if total else 0.0, total))
+    print("    reference: {:.1f} ms, fused: {:.1f} ms, speedup: {:.2f}x".format(
+        timings['reference'] * 1000, timings['fused'] * 1000, timings['reference'] / timings['fused']))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Report instruction fusion rate and speedup')
+    parser.add_argument('roms', nargs='+', metavar='ROM_PATH')
+    parser.add_argument('--frames', type=int, default=60, help='frames to run (default: 60)')
+    parser.add_argument('--instructions-per-frame', type=int, default=10, help='(default: 10)')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per engine, fastest is reported (default: 5)')
+    args = parser.parse_args()
+    for rom_path in args.roms:
+        benchmark(rom_path, args.frames, args.instructions_per_frame, args.repeat)
@@ -0,0 +1,477 @@
+__author__ = 'jaya'
+
+# External imports
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from multiprocessing import Pool
+
+# Local imports
+from cpu import CPU, ENGINES
+from display import Chip8Screen
+from analysis import analyze_program, PROGRAM_START
+from disassembler import disassemble
+
+# Constants
+BASE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+ROM_DIRECTORY = os.path.join(BASE_DIRECTORY, 'roms')
+FAILURE_DIRECTORY = os.path.join(BASE_DIRECTORY, 'fuzz_failures')
+DEFAULT_CYCLES = 2000
+INSTRUCTIONS_PER_FRAME = 10
+MIN_PROGRAM_INSTRUCTIONS = 4
+MAX_PROGRAM_INSTRUCTIONS = 128
+MAX_PROGRAM_SIZE = 0x1000 - PROGRAM_START
+GRANULARITIES = ('step', 'frame')
+F_INSTRUCTIONS = (0x07, 0x0A, 0x15, 0x18, 0x1E, 0x29, 0x33, 0x55, 0x65)
+EIGHT_INSTRUCTIONS = (0x0, 0x1, 0x2, 0x3, 0x4, 0x5, 0x6, 0x7, 0xE)
+
+class FuzzCase(object):
+    def __init__(self, program, v=None, i=0, delay_timer=0, sound_timer=0, keys=None, random_seed=0,
+                 analysis=False, shift_Vy=False):
+        """
+        Program and initial state run on every engine.
+        :param program: ROM contents
+        :param v: initial V registers
+        :param i: initial I register
+        :param keys: initial state of the 16 keys
+        :param random_seed: seed of CPU random generator, for Cxkk
+        :param analysis: give static analysis of program to CPU, as the app does
+        :param shift_Vy: shift_Vy quirk
+        """
+        self.program = bytes(program)
+        self.v = list(v or [0] * 16)
+        self.i = i
+        self.delay_timer = delay_timer
+        self.sound_timer = sound_timer
+        self.keys = list(keys or [0] * 16)
+        self.random_seed = random_seed
+        self.analysis = analysis
+        self.shift_Vy = shift_Vy
+
+    def copy(self, **changes):
+        case = FuzzCase(**self.to_dict(hex_program=False))
+        for name, value in changes.items():
+            setattr(case, name, value)
+        return case
+
+    def to_dict(self, hex_program=True):
+        return {
+            'program': self.program.hex() if hex_program else self.program,
+            'v': self.v,
+            'i': self.i,
+            'delay_timer': self.delay_timer,
+            'sound_timer': self.sound_timer,
+            'keys': self.keys,
+            'random_seed': self.random_seed,
+            'analysis': self.analysis,
+            'shift_Vy': self.shift_Vy
+        }
+
+    @staticmethod
+    def from_dict(data):
+        data = dict(data)
+        data['program'] = bytes.fromhex(data['program'])
+        return FuzzCase(**data)
+
+
+class Divergence(object):
+    def __init__(self, step, instructions, program_counter, differences):
+        """
+        First point where engines disagree.
+        :param step: number of compared steps or frames before divergence
+        :param instructions: instructions executed by reference engine, including diverging step
+        :param program_counter: reference program counter before diverging step
+        :param differences: list of descriptions of differing state
+        """
+        self.step = step
+        self.instructions = instructions
+        self.program_counter = program_counter
+        self.differences = differences
+
+    def describe(self):
+        return "step {} (instruction {}, PC 0x{:03X}): {}".format(
+            self.step, self.instructions, self.program_counter, '; '.join(self.differences))
+
+
+def random_instructions(rng, count):
+    """
+    Generate a short instruction sequence. Jump and I targets are mostly inside
+    program, and patterns fused by fast engines are generated often.
+    :param rng: random.Random
+    :param count: number of instructions in program, for jump targets
+    :return: list of opcodes
+    """
+    x = rng.randrange(16)
+    y = rng.randrange(16)
+    kk = rng.randrange(256)
+    target = PROGRAM_START + 2 * rng.randrange(count)
+    choice = rng.random()
+    if choice < 0.2:
+        pattern = rng.randrange(4)
+        skip = rng.choice((0x3000, 0x4000))
+        if pattern == 0:
+            address = rng.choice((target, rng.randrange(0x50), rng.randrange(0x1000)))
+            return [0xA000 | address, 0xD000 | (x << 8) | (y << 4) | rng.randrange(16)]
+        if pattern == 1:
+            return [skip | (x << 8) | kk, 0x1000 | target]
+        if pattern == 2:
+            return [0x6000 | (rng.randrange(16) << 8) | rng.randrange(256) for _ in range(rng.randint(2, 5))]
+        return [0xF007 | (x << 8), skip | (x << 8) | kk, 0x1000 | target]
+    if choice < 0.3:
+        return [rng.choice((0x1000 | target, 0x2000 | target, 0x00EE, 0xB000 | target - rng.randrange(16)))]
+    if choice < 0.9:
+        nibble = rng.randrange(16)
+        if nibble == 0x0:
+            return [rng.choice((0x00E0, 0x00EE))]
+        if nibble in (0x1, 0x2, 0xA, 0xB):
+            return [(nibble << 12) | target]
+        if nibble in (0x5, 0x9):
+            return [(nibble << 12) | (x << 8) | (y << 4)]
+        if nibble == 0x8:
+            return [0x8000 | (x << 8) | (y << 4) | rng.choice(EIGHT_INSTRUCTIONS)]
+        if nibble == 0xD:
+            return [0xD000 | (x << 8) | (y << 4) | rng.randrange(16)]
+        if nibble == 0xE:
+            return [0xE000 | (x << 8) | rng.choice((0x9E, 0xA1))]
+        if nibble == 0xF:
+            return [0xF000 | (x << 8) | rng.choice(F_INSTRUCTIONS)]
+        return [(nibble << 12) | (x << 8) | kk]
+    return [rng.randrange(0x10000)]
+
+def random_program(rng):
+    """
+    :return: ROM contents made of random instructions
+    """
+    count = rng.randint(MIN_PROGRAM_INSTRUCTIONS, MAX_PROGRAM_INSTRUCTIONS)
+    opcodes = list()
+    while len(opcodes) < count:
+        opcodes.extend(random_instructions(rng, count))
+    return b''.join(opcode.to_bytes(2, 'big') for opcode in opcodes[:count])
+
+def mutate_program(rng, program):
+    """
+    Apply a few random mutations: bit flips, replaced, inserted, deleted and duplicated instructions.
+    :return: mutated ROM contents
+    """
+    program = bytearray(program)
+    for _ in range(rng.randint(1, 4)):
+        count = max(len(program) // 2, 1)
+        offset = 2 * rng.randrange(count)
+        mutation = rng.randrange(5)
+        if mutation == 0:
+            index = rng.randrange(len(program))
+            program[index] ^= 1 << rng.randrange(8)
+        elif mutation == 1:
+            replacement = b''.join(opcode.to_bytes(2, 'big') for opcode in random_instructions(rng, count))
+            program[offset: offset + len(replacement)] = replacement
+        elif mutation == 2:
+            program[offset: offset] = b''.join(opcode.to_bytes(2, 'big') for opcode in random_instructions(rng, count))
+        elif mutation == 3 and len(program) > 2:
+            del program[offset: offset + 2 * rng.randint(1, 4)]
+        else:
+            size = 2 * rng.randint(1, 8)
+            program[offset: offset] = program[offset: offset + size]
+    return bytes(program[:MAX_PROGRAM_SIZE]) or b'\x00\xe0'
+
+def generate_case(seed, corpus):
+    """
+    Create random or mutated program with random initial state.
+    :param seed: case seed, same seed gives same case
+    :param corpus: list of ROM contents to mutate
+    :return: FuzzCase
+    """
+    rng = random.Random(seed)
+    if corpus and rng.random() < 0.5:
+        program = mutate_program(rng, rng.choice(corpus))
+    else:
+        program = random_program(rng)
+    return FuzzCase(program,
+                    v=[rng.randrange(256) for _ in range(16)],
+                    i=rng.choice((0, rng.randrange(0x50), PROGRAM_START + rng.randrange(len(program)), rng.randrange(0x1000))),
+                    delay_timer=rng.choice((0, rng.randrange(256))),
+                    sound_timer=rng.choice((0, rng.randrange(256))),
+                    keys=[1 if rng.random() < 0.1 else 0 for _ in range(16)],
+                    random_seed=rng.randrange(1 << 32),
+                    analysis=rng.random() < 0.5,
+                    shift_Vy=rng.random() < 0.5)
+
+
+def create_cpu(case, engine):
+    """
+    Load case into a headless CPU running given engine
+    :return: CPU object
+    """
+    # CPU loads ROMs from files. The file is only needed until program is in memory.
+    rom_path = os.path.join(tempfile.gettempdir(), 'chip8_fuzz_{}.ch8'.format(os.getpid()))
+    with open(rom_path, 'wb') as fh:
+        fh.write(case.program)
+    cpu = CPU(binary=rom_path, screen=Chip8Screen(), sound=None)
+    cpu.realtime_timers = False
+    cpu.shift_Vy = case.shift_Vy
+    cpu.random.seed(case.random_seed)
+    if case.analysis:
+        cpu.analysis = analyze_program(case.program)
+    cpu.set_engine(engine)
+    try:
+        cpu.initialize_cpu()
+    finally:
+        os.remove(rom_path)
+    registers = cpu.registers
+    registers.v[:] = bytes(case.v)
+    registers.i = case.i
+    registers.delay_timer = case.delay_timer
+    registers.sound_timer = case.sound_timer
+    cpu.keys_pressed[:] = case.keys
+    return cpu
+
+def call(function, *args):
+    """
+    :return: tuple (return value of function or None if it raised,
+             None or description of exception raised by function)
+    """
+    try:
+        return function(*args), None
+    except Exception as error:
+        return None, "{}: {}".format(type(error).__name__, error)
+
+def compare(reference, candidate, reference_error, candidate_error, reference_count=None, candidate_count=None):
+    """
+    Compare full state of two CPUs, and instructions executed if counts are given
+    :return: list of differences, empty if states are equal
+    """
+    differences = list()
+    if reference_error != candidate_error:
+        differences.append("exception {} != {}".format(reference_error, candidate_error))
+    if reference_count != candidate_count:
+        differences.append("executed {} != {} instructions".format(reference_count, candidate_count))
+    for name, expected, actual in zip(CPU.Status._fields, reference.status(), candidate.status()):
+        if expected != actual:
+            differences.append("{} 0x{:X} != 0x{:X}".format(name, expected, actual))
+    # compare underlying buffers, comparing memoryviews is much slower
+    if reference.registers.v != candidate.registers.v:
+        for index in range(16):
+            expected, actual = reference.registers.v[index], candidate.registers.v[index]
+            if expected != actual:
+                differences.append("V{:X} 0x{:02X} != 0x{:02X}".format(index, expected, actual))
+    if reference.stack != candidate.stack:
+        differences.append("stack {} != {}".format(reference.stack[16:], candidate.stack[16:]))
+    if reference.memory_buffer != candidate.memory_buffer:
+        address = next(address for address in range(reference.total_memory)
+                       if reference.memory_buffer[address] != candidate.memory_buffer[address])
+        differences.append("memory at 0x{:03X}".format(address))
+    if reference.screen.display_buffer != candidate.screen.display_buffer:
+        pixels = sum(1 for expected, actual in zip(reference.screen.display_buffer, candidate.screen.display_buffer)
+                     if expected != actual)
+        differences.append("{} display pixels".format(pixels))
+    if reference.is_running != candidate.is_running:
+        differences.append("running {} != {}".format(reference.is_running, candidate.is_running))
+    return differences
+
+def run_case(case, engine, cycles=DEFAULT_CYCLES, granularity='step'):
+    """
+    Run case on reference and given engine side by side and compare full state after every step.
+    In 'step' granularity a step is one dispatch of the engine, and the reference
+    runs as many instructions as the engine reported. Timers tick every
+    INSTRUCTIONS_PER_FRAME instructions. In 'frame' granularity both run run_frame,
+    and the numbers of instructions they report are compared too.
+    :param case: FuzzCase
+    :param engine: engine compared to reference, one of cpu.ENGINES
+    :param cycles: number of reference instructions to run
+    :param granularity: one of GRANULARITIES
+    :return: tuple (Divergence or None, instructions executed by reference engine)
+    """
+    reference = create_cpu(case, 'reference')
+    candidate = create_cpu(case, engine)
+    executed = 0
+    frames = -(-cycles // INSTRUCTIONS_PER_FRAME)
+    next_tick = INSTRUCTIONS_PER_FRAME
+    step = 0
+    while executed < cycles and reference.is_running:
+        program_counter = reference.program_counter
+        reference_count = candidate_count = None
+        if granularity == 'frame':
+            reference_count, reference_error = call(reference.run_frame, INSTRUCTIONS_PER_FRAME)
+            candidate_count, candidate_error = call(candidate.run_frame, INSTRUCTIONS_PER_FRAME)
+            # instructions of a frame that raised are not counted, run_frame returns nothing then
+            executed += reference_count or 0
+        else:
+            before = getattr(candidate.engine, 'fused_instructions_executed', 0)
+            _, candidate_error = call(candidate.execute_one_instruction)
+            count = getattr(candidate.engine, 'fused_instructions_executed', 0) - before or 1
+            reference_error = None
+            for _ in range(count):
+                _, reference_error = call(reference.execute_one_instruction)
+                executed += 1
+                if reference_error or not reference.is_running:
+                    break
+            if executed >= next_tick and not (reference_error or candidate_error):
+                reference.tick_timers()
+                candidate.tick_timers()
+                next_tick += INSTRUCTIONS_PER_FRAME
+        differences = compare(reference, candidate, reference_error, candidate_error, reference_count, candidate_count)
+        if differences:
+            return Divergence(step, executed, program_counter, differences), executed
+        if reference_error:
+            break
+        step += 1
+        if granularity == 'frame' and step >= frames:
+            # frames waiting on Fx0A execute nothing, so executed alone may never reach cycles
+            break
+    return None, executed
+
+def shrink(case, engine, cycles, granularity):
+    """
+    Reduce diverging case to a minimal reproducer: remove instructions while
+    the engines still diverge, then reset initial state where possible.
+    :return: tuple (FuzzCase, cycles, Divergence)
+    """
+    divergence, _ = run_case(case, engine, cycles, granularity)
+    cycles = divergence.instructions
+
+    def diverges(candidate):
+        return run_case(candidate, engine, cycles, granularity)[0] is not None
+
+    instructions = [case.program[offset: offset + 2] for offset in range(0, len(case.program), 2)]
+    chunk = len(instructions) // 2
+    while chunk >= 1:
+        index = 0
+        while index < len(instructions):
+            remaining = instructions[:index] + instructions[index + chunk:]
+            if remaining and diverges(case.copy(program=b''.join(remaining))):
+                instructions = remaining
+            else:
+                index += chunk
+        chunk //= 2
+    case = case.copy(program=b''.join(instructions))
+
+    simplifications = [('analysis', False), ('shift_Vy', False), ('keys', [0] * 16), ('i', 0),
+                       ('delay_timer', 0), ('sound_timer', 0), ('random_seed', 0), ('v', [0] * 16)]
+    for name, value in simplifications:
+        candidate = case.copy(**{name: value})
+        if diverges(candidate):
+            case = candidate
+    for index in range(16):
+        if case.v[index]:
+            candidate = case.copy(v=case.v[:index] + [0] + case.v[index + 1:])
+            if diverges(candidate):
+                case = candidate
+    divergence, _ = run_case(case, engine, cycles, granularity)
+    return case, divergence.instructions, divergence
+
+# Bundled ROMs, loaded once per process
+corpus = None
+
+def fuzz(arguments):
+    """
+    Run one case, shrinking it if engines diverge. Runs in worker processes.
+    :param arguments: tuple (seed, engine, cycles, granularity, corpus paths)
+    :return: tuple (seed, instructions executed, result dict or None)
+    """
+    global corpus
+    seed, engine, cycles, granularity, corpus_paths = arguments
+    if corpus is None:
+        corpus = list()
+        for path in corpus_paths:
+            with open(path, 'rb') as fh:
+                corpus.append(fh.read())
+    case = generate_case(seed, corpus)
+    divergence, executed = run_case(case, engine, cycles, granularity)
+    if divergence is None:
+        return seed, executed, None
+    minimal_case, minimal_cycles, minimal_divergence = shrink(case, engine, cycles, granularity)
+    return seed, divergence.instructions, {
+        'seed': seed,
+        'engine': engine,
+        'granularity': granularity,
+        'cycles': minimal_cycles,
+        'divergence': minimal_divergence.describe(),
+        'original_size': len(case.program),
+        'case': minimal_case.to_dict()
+    }
+
+def save_failure(result):
+    """
+    Write minimal reproducer ROM and JSON with initial state
+    :return: path of JSON file
+    """
+    if not os.path.isdir(FAILURE_DIRECTORY):
+        os.makedirs(FAILURE_DIRECTORY)
+    name = "{}-{}-{}".format(result['engine'], result['granularity'], result['seed'])
+    with open(os.path.join(FAILURE_DIRECTORY, name + '.ch8'), 'wb') as fh:
+        fh.write(bytes.fromhex(result['case']['program']))
+    path = os.path.join(FAILURE_DIRECTORY, name + '.json')
+    with open(path, 'w') as fh:
+        json.dump(result, fh, indent=2)
+    return path
+
+def print_program(program):
+    for offset in range(0, len(program) - 1, 2):
+        opcode = (program[offset] << 8) | program[offset + 1]
+        print("    0x{:03X}: {:04X}  {}".format(PROGRAM_START + offset, opcode, disassemble(opcode)))
+
+def replay(path):
+    """
+    Run saved reproducer again and print divergence
+    :return: True if engines still diverge
+    """
+    with open(path) as fh:
+        result = json.load(fh)
+    case = FuzzCase.from_dict(result['case'])
+    divergence, _ = run_case(case, result['engine'], result['cycles'], result['granularity'])
+    print("Program:")
+    print_program(case.program)
+    print("Initial state: V {} I 0x{:03X} DT {} ST {} keys {}".format(
+        ' '.join("{:02X}".format(value) for value in case.v), case.i, case.delay_timer, case.sound_timer,
+        ''.join(map(str, case.keys))))
+    if divergence is None:
+        print("Engines agree")
+        return False
+    print("Diverged at {}".format(divergence.describe()))
+    return True
+
+def main(engine, cases, cycles, granularity, seed, jobs, corpus_paths):
+    """
+    Fuzz given number of cases in parallel
+    :return: number of diverging cases
+    """
+    start = time.perf_counter()
+    work = [(case_seed, engine, cycles, granularity, corpus_paths) for case_seed in range(seed, seed + cases)]
+    failures = 0
+    instructions = 0
+    with Pool(jobs) as pool:
+        for case_seed, executed, result in pool.imap_unordered(fuzz, work, chunksize=4):
+            instructions += executed
+            if result:
+                failures += 1
+                path = save_failure(result)
+                print("DIVERGED seed {}: {} ({} -> {} bytes) - {}".format(
+                    case_seed, result['divergence'], result['original_size'], len(result['case']['program']) // 2, path))
+    elapsed = time.perf_counter() - start
+    print("{} cases, {} diverged, {} instructions per engine in {:.2f} sec".format(cases, failures, instructions, elapsed))
+    return failures
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Differential fuzzer of execution engines against reference engine')
+    parser.add_argument('--engine', choices=[engine for engine in ENGINES if engine != 'reference'], default='fused',
+                        help='engine to compare with reference (default: fused)')
+    parser.add_argument('--cases', type=int, default=1000, help='number of cases (default: 1000)')
+    parser.add_argument('--cycles', type=int, default=DEFAULT_CYCLES,
+                        help='instructions per case (default: {})'.format(DEFAULT_CYCLES))
+    parser.add_argument('--granularity', choices=GRANULARITIES, default='step',
+                        help='compare after every engine step or every frame (default: step)')
+    parser.add_argument('--seed', type=int, default=0, help='seed of first case (default: 0)')
+    parser.add_argument('--jobs', type=int, default=None, help='worker processes (default: number of CPUs)')
+    parser.add_argument('--corpus', nargs='*', metavar='ROM_PATH', default=None,
+                        help='ROMs to mutate (default: all ROMs in {})'.format(ROM_DIRECTORY))
+    parser.add_argument('--replay', metavar='JSON_PATH', help='run saved reproducer and print divergence')
+    args = parser.parse_args()
+    if args.replay:
+        sys.exit(1 if replay(args.replay) else 0)
+    corpus_paths = args.corpus
+    if corpus_paths is None:
+        corpus_paths = sorted(os.path.join(ROM_DIRECTORY, name) for name in os.listdir(ROM_DIRECTORY))
+    sys.exit(1 if main(args.engine, args.cases, args.cycles, args.granularity, args.seed, args.jobs, corpus_paths) else 0)
@@ -0,0 +1,284 @@
+__author__ = 'jaya'
+
+# External imports
+import argparse
+import json
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# Local imports
+from log import create_logger
+from analysis import analyze_program, ANALYSIS_VERSION, PROGRAM_START
+from disassembler import disassemble
+from rom_database import rom_hash
+
+# Setup logger
+logger = create_logger(__name__)
+
+# Set logging level
+DEBUG = 10
+NOTSET = 0
+logger.setLevel(NOTSET)
+
+# Constants
+DEFAULT_INDEX_PATH = 'rom_index.sqlite'
+MAX_ROM_SIZE = 0x10000  # XO-CHIP can address 64 KB
+CHIP8_MAX_ROM_SIZE = 0x1000 - PROGRAM_START
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL,
+    sha1 TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_sha1 ON files (sha1);
+CREATE TABLE IF NOT EXISTS roms (
+    sha1 TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    extensions TEXT NOT NULL,
+    instruction_count INTEGER NOT NULL,
+    histogram TEXT NOT NULL,
+    warnings TEXT NOT NULL,
+    indexed_at REAL NOT NULL
+);
+"""
+
+def opcode_class(opcode):
+    """
+    Name of instruction pattern for given opcode, like "8xy4" or "Fx07".
+    :param opcode: 2 byte opcode
+    :return: pattern string
+    """
+    lookup_opcode = opcode >> 12
+    if lookup_opcode == 0x0:
+        if opcode in (0x00E0, 0x00EE, 0x00FB, 0x00FC, 0x00FD, 0x00FE, 0x00FF):
+            return "{:04X}".format(opcode)
+        if (opcode & 0xfff0) in (0x00C0, 0x00D0):
+            return "{:03X}n".format(opcode >> 4)
+        return "0nnn"
+    if lookup_opcode in (0x1, 0x2, 0xA, 0xB):
+        return "{:X}nnn".format(lookup_opcode)
+    if lookup_opcode in (0x3, 0x4, 0x6, 0x7, 0xC):
+        return "{:X}xkk".format(lookup_opcode)
+    if lookup_opcode in (0x5, 0x8, 0x9):
+        return "{:X}xy{:X}".format(lookup_opcode, opcode & 0x000f)
+    if lookup_opcode == 0xD:
+        return "Dxy0" if (opcode & 0x000f) == 0 else "Dxyn"
+    if opcode == 0xF000:
+        return "F000"
+    return "{:X}x{:02X}".format(lookup_opcode, opcode & 0x00ff)
+
+# Instruction patterns used by this emulator
+CHIP8_CLASSES = set([
+    "00E0", "00EE", "0nnn", "1nnn", "2nnn", "3xkk", "4xkk", "5xy0", "6xkk", "7xkk",
+    "8xy0", "8xy1", "8xy2", "8xy3", "8xy4", "8xy5", "8xy6", "8xy7", "8xyE", "9xy0",
+    "Annn", "Bnnn", "Cxkk", "Dxyn", "Ex9E", "ExA1", "Fx07", "Fx0A", "Fx15", "Fx18",
+    "Fx1E", "Fx29", "Fx33", "Fx55", "Fx65"
+])
+SCHIP_CLASSES = set(["00Cn", "00FB", "00FC", "00FD", "00FE", "00FF", "Dxy0", "Fx30", "Fx75", "Fx85"])
+XOCHIP_CLASSES = set(["00Dn", "5xy2", "5xy3", "F000", "Fx01", "Fx02", "Fx3A"])
+
+def analyze_rom(contents):
+    """
+    Single pass over code reachable from 0x200: opcode histogram, extension set and warnings.
+    :param contents: ROM contents
+    :return: dict with extensions, instruction_count, histogram and warnings
+    """
+    analysis = analyze_program(contents)
+    end = PROGRAM_START + len(contents)
+    histogram = dict()
+    extensions = set(['CHIP-8'])
+    warnings = list()
+    if len(contents) > CHIP8_MAX_ROM_SIZE:
+        warnings.append("ROM is {} bytes, larger than CHIP-8 memory allows ({} bytes)".format(len(contents), CHIP8_MAX_ROM_SIZE))
+    for address, opcode in sorted(analysis.instructions.items()):
+        name = opcode_class(opcode)
+        histogram[name] = histogram.get(name, 0) + 1
+        if name in SCHIP_CLASSES:
+            extensions.add('SCHIP')
+        elif name in XOCHIP_CLASSES:
+            extensions.add('XO-CHIP')
+        elif name not in CHIP8_CLASSES:
+            warnings.append("Unknown instruction {} at 0x{:03X}".format(disassemble(opcode), address))
+        elif name == '0nnn':
+            warnings.append("Machine code call {} at 0x{:03X} is ignored".format(disassemble(opcode), address))
+        if name in ('1nnn', '2nnn'):
+            target = opcode & 0x0fff
+            if target < PROGRAM_START or target >= end:
+                warnings.append("{} at 0x{:03X} jumps outside program".format(disassemble(opcode), address))
+            elif target & 1:
+                warnings.append("{} at 0x{:03X} jumps to odd address".format(disassemble(opcode), address))
+    for address in analysis.computed_jumps:
+        warnings.append("Computed jump at 0x{:03X}, code after it was not analyzed".format(address))
+    if extensions - set(['CHIP-8']):
+        warnings.append("Uses {} instructions, which this emulator does not support".format(
+            ', '.join(sorted(extensions - set(['CHIP-8'])))))
+    return {
+        'extensions': sorted(extensions),
+        'instruction_count': len(analysis.instructions),
+        'histogram': histogram,
+        'warnings': warnings
+    }
+
+def index_file(path):
+    """
+    Read and analyze one ROM file. Runs in worker processes.
+    :param path: path to ROM
+    :return: tuple (path, sha1, analysis dict or None if file is too big)
+    """
+    with open(path, 'rb') as fh:
+        contents = fh.read()
+    sha1 = rom_hash(contents)
+    if not contents or len(contents) > MAX_ROM_SIZE:
+        return path, sha1, None
+    result = analyze_rom(contents)
+    result['size'] = len(contents)
+    return path, sha1, result
+
+
+class RomIndex(object):
+    def __init__(self, path=DEFAULT_INDEX_PATH):
+        """
+        SQLite index of ROM files. Files are keyed by path, analysis by SHA-1,
+        so copies of a ROM are analyzed once.
+        :param path: path to SQLite database
+        """
+        self.connection = sqlite3.connect(path)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript(SCHEMA)
+        # results of an older analysis are dropped, update then analyzes those ROMs again
+        if self.connection.execute("PRAGMA user_version").fetchone()[0] != ANALYSIS_VERSION:
+            with self.connection:
+                self.connection.execute("DELETE FROM roms")
+                self.connection.execute("PRAGMA user_version = {:d}".format(ANALYSIS_VERSION))
+
+    def close(self):
+        self.connection.close()
+
+    def update(self, directory, jobs=None):
+        """
+        Index ROMs under directory. Only new or changed files are analyzed,
+        files that no longer exist are removed from index. Files that can not be
+        read or analyzed are logged and skipped, they are tried again on next update.
+        :param directory: ROM directory, searched recursively
+        :param jobs: number of worker processes (default: number of CPUs)
+        :return: tuple (number of files analyzed, number of files removed, number of files skipped)
+        """
+        known = dict((row['path'], (row['mtime'], row['size'], row['sha1']))
+                     for row in self.connection.execute("SELECT path, mtime, size, sha1 FROM files"))
+        known_hashes = set(row[0] for row in self.connection.execute("SELECT sha1 FROM roms"))
+        seen = set()
+        changed = list()
+        failed = 0
+        for root, _, names in os.walk(directory):
+            for name in names:
+                path = os.path.abspath(os.path.join(root, name))
+                try:
+                    stat = os.stat(path)
+                except OSError as error:
+                    # broken symlink, or file removed while walking
+                    logger.warning("Skipping {}: {}".format(path, error))
+                    failed += 1
+                    continue
+                if not stat.st_size or stat.st_size > MAX_ROM_SIZE:
+                    continue
+                seen.add(path)
+                previous = known.get(path)
+                if previous is None or previous[0] != stat.st_mtime or previous[1] != stat.st_size or previous[2] not in known_hashes:
+                    changed.append((path, stat.st_mtime, stat.st_size))
+
+        removed = [path for path in known if path not in seen and path.startswith(os.path.abspath(directory) + os.sep)]
+        with self.connection:
+            self.connection.executemany("DELETE FROM files WHERE path = ?", [(path,) for path in removed])
+        analyzed = 0
+        with self.connection:
+            if changed:
+                with ProcessPoolExecutor(max_workers=jobs) as executor:
+                    stats = dict((path, (mtime, size)) for path, mtime, size in changed)
+                    futures = dict((executor.submit(index_file, path), path) for path in stats)
+                    for future in as_completed(futures):
+                        try:
+                            path, sha1, result = future.result()
+                        except Exception as error:
+                            logger.warning("Skipping {}: {!r}".format(futures[future], error))
+                            failed += 1
+                            continue
+                        if result is None:
+                            continue
+                        analyzed += 1
+                        mtime, size = stats[path]
+                        self.connection.execute("INSERT OR REPLACE INTO files (path, mtime, size, sha1) VALUES (?, ?, ?, ?)",
+                                                (path, mtime, size, sha1))
+                        if sha1 not in known_hashes:
+                            known_hashes.add(sha1)
+                            self.connection.execute(
+                                "INSERT OR REPLACE INTO roms (sha1, size, extensions, instruction_count, histogram, warnings, indexed_at) "
+                                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                (sha1, result['size'], ','.join(result['extensions']), result['instruction_count'],
+                                 json.dumps(result['histogram'], sort_keys=True), json.dumps(result['warnings']), time.time()))
+            self.connection.execute("DELETE FROM roms WHERE sha1 NOT IN (SELECT sha1 FROM files)")
+        logger.debug("Indexed {} files, removed {}, skipped {}".format(analyzed, len(removed), failed))
+        return analyzed, len(removed), failed
+
+    def find(self, extension=None, uses=None, without_warnings=False, sha1=None):
+        """
+        Select indexed ROMs.
+        :param extension: only ROMs using this extension ('CHIP-8', 'SCHIP', 'XO-CHIP')
+        :param uses: only ROMs using this instruction pattern, like 'Fx0A'
+        :param without_warnings: only ROMs without static warnings
+        :param sha1: only ROMs whose SHA-1 starts with this prefix
+        :return: list of dicts with path, sha1, size, extensions, instruction_count, histogram and warnings
+        """
+        query = ("SELECT files.path, roms.* FROM files JOIN roms ON files.sha1 = roms.sha1 WHERE 1")
+        parameters = list()
+        if extension:
+            query += " AND (',' || roms.extensions || ',') LIKE ?"
+            parameters.append('%,{},%'.format(extension))
+        if sha1:
+            query += " AND roms.sha1 LIKE ?"
+            parameters.append(sha1 + '%')
+        if without_warnings:
+            query += " AND roms.warnings = '[]'"
+        query += " ORDER BY files.path"
+        rows = list()
+        for row in self.connection.execute(query, parameters):
+            rom = dict(row)
+            rom['extensions'] = rom['extensions'].split(',')
+            rom['histogram'] = json.loads(rom['histogram'])
+            rom['warnings'] = json.loads(rom['warnings'])
+            if uses and uses not in rom['histogram']:
+                continue
+            rows.append(rom)
+        return rows
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Index CHIP-8 ROM collection in SQLite')
+    parser.add_argument('--index', default=DEFAULT_INDEX_PATH, help='index database (default: {})'.format(DEFAULT_INDEX_PATH))
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    index_parser = subparsers.add_parser('index', help='index new and changed ROMs in directory')
+    index_parser.add_argument('directory', metavar='ROM_DIRECTORY')
+    index_parser.add_argument('--jobs', type=int, default=None, help='worker processes (default: number of CPUs)')
+    list_parser = subparsers.add_parser('list', help='list indexed ROMs')
+    list_parser.add_argument('--extension', choices=['CHIP-8', 'SCHIP', 'XO-CHIP'])
+    list_parser.add_argument('--uses', metavar='PATTERN', help="instruction pattern like 'Fx0A' or '8xy6'")
+    list_parser.add_argument('--sha1', metavar='PREFIX')
+    list_parser.add_argument('--without-warnings', action='store_true')
+    list_parser.add_argument('--warnings', action='store_true', help='print warnings of each ROM')
+    args = parser.parse_args()
+
+    rom_index = RomIndex(args.index)
+    if args.command == 'index':
+        start = time.perf_counter()
+        analyzed, removed, failed = rom_index.update(args.directory, args.jobs)
+        print("Analyzed {} new or changed files, removed {}, skipped {} unreadable in {:.2f} sec".format(
+            analyzed, removed, failed, time.perf_counter() - start))
+    else:
+        for rom in rom_index.find(args.extension, args.uses, args.without_warnings, args.sha1):
+            print("{}  {:5d} bytes  {:4d} instructions  {}  {}".format(
+                rom['sha1'][:12], rom['size'], rom['instruction_count'], '/'.join(rom['extensions']), rom['path']))
+            if args.warnings:
+                for warning in rom['warnings']:
+                    print("    {}".format(warning))
+    rom_index.close()
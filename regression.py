@@ -0,0 +1,277 @@
+__author__ = 'jaya'
+
+# External imports
+import argparse
+import contextlib
+import hashlib
+import io
+import os
+import sys
+import time
+
+# Local imports
+from cpu import CPU
+from display import Chip8Screen
+
+# Constants
+BASE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+ROM_DIRECTORY = os.path.join(BASE_DIRECTORY, 'roms')
+GOLDEN_DIRECTORY = os.path.join(BASE_DIRECTORY, 'golden')
+INSTRUCTIONS_PER_FRAME = 10
+STABLE_FRAMES = 60  # frame is stable when display buffer did not change for these many frames
+MAX_FRAMES = 3000
+RANDOM_SEED = 0
+
+def use_reference_engine(cpu):
+    pass
+
+def use_fused_engine(cpu):
+    cpu.set_engine('fused')
+
+def use_debugger_engine(cpu):
+    # A breakpoint that is never hit keeps debugger's checking execute_one_instruction installed
+    cpu.get_debugger().add_breakpoint(cpu.total_memory - 2)
+
+# Engine name -> function that switches given CPU to that engine
+ENGINES = {
+    'reference': use_reference_engine,
+    'fused': use_fused_engine,
+    'debugger': use_debugger_engine
+}
+
+# Debugger console commands run on every ROM. None of them may end the console.
+# regs comes first, before anything was executed, and again right after reset.
+DEBUGGER_SCRIPT = ('regs', 'list', 'step', 'regs', 'next', 'reset', 'regs', 'step 3', 'regs')
+
+# Quirk setting name -> CPU attributes
+QUIRKS = {
+    'default': {},
+    'shift_Vy': {'shift_Vy': True}
+}
+
+# Names of cpu_state fields, for reporting differences
+STATE_FIELDS = ('program counter', 'V', 'I', 'delay timer', 'sound timer', 'stack', 'memory', 'display', 'running')
+
+def create_cpu(rom, engine='reference', quirks='default'):
+    """
+    Headless CPU with 60 Hz timers, loaded with ROM
+    :param rom: path to ROM
+    :param engine: one of ENGINES keys
+    :param quirks: one of QUIRKS keys
+    :return: CPU
+    """
+    cpu = CPU(binary=rom, screen=Chip8Screen(), sound=None)
+    cpu.random.seed(RANDOM_SEED)
+    cpu.realtime_timers = False
+    for name, value in QUIRKS[quirks].items():
+        setattr(cpu, name, value)
+    cpu.initialize_cpu()
+    ENGINES[engine](cpu)
+    return cpu
+
+def cpu_state(cpu):
+    """
+    Everything an engine can change, in STATE_FIELDS order
+    :return: tuple
+    """
+    registers = cpu.registers
+    return (cpu.program_counter, tuple(registers.v), registers.i, registers.delay_timer, registers.sound_timer,
+            tuple(cpu.stack), bytes(cpu.memory_buffer), bytes(cpu.screen.display_buffer), cpu.is_running)
+
+def run_to_stable_frame(rom, engine='reference', quirks='default'):
+    """
+    Run ROM headless with 60 Hz timers until display buffer stops changing.
+    :param rom: path to ROM
+    :param engine: one of ENGINES keys
+    :param quirks: one of QUIRKS keys
+    :return: tuple (display buffer bytes, number of frames executed)
+    """
+    cpu = create_cpu(rom, engine, quirks)
+    screen = cpu.screen
+    last_frame = None
+    stable = 0
+    frame = 0
+    for snapshot in cpu.frames(INSTRUCTIONS_PER_FRAME, inputs=[None] * MAX_FRAMES):
+        frame = snapshot.number
+        if snapshot.display_buffer == last_frame:
+            stable += 1
+            if stable >= STABLE_FRAMES:
+                break
+        else:
+            stable = 0
+            last_frame = snapshot.display_buffer
+    return bytes(screen.display_buffer), frame
+
+def compare_with_reference(rom, engine, quirks, frames):
+    """
+    Run ROM on reference engine and given engine side by side. After every frame
+    both must have executed the same number of instructions and be in the same state.
+    Final frames alone do not show an engine running frames of the wrong length.
+    :param frames: number of frames to compare
+    :return: None if engines agree, else description of first difference
+    """
+    reference = create_cpu(rom, 'reference', quirks)
+    cpu = create_cpu(rom, engine, quirks)
+    for frame in range(1, frames + 1):
+        expected_instructions = reference.run_frame(INSTRUCTIONS_PER_FRAME)
+        instructions = cpu.run_frame(INSTRUCTIONS_PER_FRAME)
+        if instructions != expected_instructions:
+            return "frame {}: executed {} instructions, reference executed {}".format(
+                frame, instructions, expected_instructions)
+        expected_state = cpu_state(reference)
+        state = cpu_state(cpu)
+        if state != expected_state:
+            return "frame {}: {} differs from reference".format(
+                frame, ', '.join(name for name, a, b in zip(STATE_FIELDS, state, expected_state) if a != b))
+        if not reference.is_running:
+            break
+    return None
+
+def check_debugger_console(rom):
+    """
+    Run DEBUGGER_SCRIPT in a debugger console on ROM. Console output is discarded.
+    :return: None if every command ran, else description of the first failure
+    """
+    from debugger import DebuggerConsole
+    console = DebuggerConsole(create_cpu(rom))
+    with contextlib.redirect_stdout(io.StringIO()):
+        for command in DEBUGGER_SCRIPT:
+            try:
+                if console.onecmd(command):
+                    return "'{}' ended the console".format(command)
+            except Exception as error:
+                return "'{}' raised {!r}".format(command, error)
+    return None
+
+def check_debugger_engine_switch(rom):
+    """
+    Switch to fused engine while a breakpoint is set. The breakpoint must still
+    be hit, and removing it must leave the fused engine in place.
+    :return: None if it works, else description of the failure
+    """
+    cpu = create_cpu(rom)
+    for _ in range(10):
+        cpu.execute_one_instruction()
+    address = cpu.program_counter
+    cpu = create_cpu(rom)
+    debugger = cpu.get_debugger()
+    debugger.add_breakpoint(address)
+    cpu.set_engine('fused')
+    cpu.run_frame(INSTRUCTIONS_PER_FRAME * 2)
+    if debugger.break_reason is None or cpu.program_counter != address:
+        return "breakpoint at 0x{:03X} was not hit, stopped at 0x{:03X}".format(address, cpu.program_counter)
+    try:
+        debugger.clear()
+    except Exception as error:
+        return "clear() raised {!r}".format(error)
+    if cpu.run_frame != cpu.engine.run_frame:
+        return "fused engine was not restored after clear()"
+    return None
+
+def frame_to_text(frame, width=64):
+    """
+    Convert display buffer to lines of '#' and '.'
+    :param frame: display buffer bytes
+    :param width: width of display
+    :return: list of strings, one per row
+    """
+    return [''.join('#' if pixel else '.' for pixel in frame[y: y + width]) for y in range(0, len(frame), width)]
+
+def text_to_frame(lines):
+    return bytes(1 if character == '#' else 0 for line in lines for character in line)
+
+def frame_hash(frame):
+    return hashlib.sha1(frame).hexdigest()
+
+def golden_path(rom, quirks):
+    return os.path.join(GOLDEN_DIRECTORY, "{}.{}.txt".format(os.path.basename(rom), quirks))
+
+def read_golden(path):
+    """
+    Read golden image. Lines starting with '#:' are comments.
+    :param path: path to golden file
+    :return: display buffer bytes
+    """
+    with open(path) as fh:
+        lines = [line.rstrip('\n') for line in fh if not line.startswith('#:')]
+    return text_to_frame(lines)
+
+def write_golden(path, rom, quirks, frame, frames_executed):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as fh:
+        fh.write("#: rom: {}\n".format(os.path.basename(rom)))
+        fh.write("#: quirks: {}\n".format(quirks))
+        fh.write("#: sha1: {}\n".format(frame_hash(frame)))
+        fh.write("#: frames: {}\n".format(frames_executed))
+        fh.write('\n'.join(frame_to_text(frame)) + '\n')
+
+def ascii_diff(expected, actual, width=64):
+    """
+    Mark differences between two frames.
+    '#' - set in both, '-' - only in expected, '+' - only in actual.
+    :return: string with one line per row
+    """
+    symbols = {(0, 0): '.', (1, 1): '#', (1, 0): '-', (0, 1): '+'}
+    cells = [symbols[(bool(e), bool(a))] for e, a in zip(expected, actual)]
+    return '\n'.join(''.join(cells[y: y + width]) for y in range(0, len(cells), width))
+
+def main(roms, engines, quirk_settings, update=False):
+    """
+    Check final frame of each ROM against golden image for every engine and quirk setting.
+    Engines other than reference are also compared with reference after every frame,
+    and debugger console and engine switching are checked on each ROM.
+    :return: number of failures
+    """
+    failures = 0
+    start = time.perf_counter()
+    for rom in roms:
+        for check, description in ((check_debugger_console, 'debugger console'),
+                                   (check_debugger_engine_switch, 'debugger engine switch')):
+            name = "{} [{}]".format(os.path.basename(rom), description)
+            error = check(rom)
+            if error is None:
+                print("PASS    {}".format(name))
+            else:
+                failures += 1
+                print("FAIL    {} {}".format(name, error))
+        for quirks in quirk_settings:
+            path = golden_path(rom, quirks)
+            for engine in engines:
+                frame, frames_executed = run_to_stable_frame(rom, engine, quirks)
+                name = "{} [{}, {}]".format(os.path.basename(rom), engine, quirks)
+                if update and engine == engines[0]:
+                    write_golden(path, rom, quirks, frame, frames_executed)
+                    print("UPDATED {} ({} frames)".format(name, frames_executed))
+                if not os.path.exists(path):
+                    failures += 1
+                    print("MISSING {} - run with --update to create {}".format(name, path))
+                    continue
+                expected = read_golden(path)
+                if frame_hash(frame) == frame_hash(expected):
+                    print("PASS    {} ({} frames)".format(name, frames_executed))
+                else:
+                    failures += 1
+                    print("FAIL    {} ({} frames)".format(name, frames_executed))
+                    print(ascii_diff(expected, frame))
+                if engine != 'reference':
+                    difference = compare_with_reference(rom, engine, quirks, frames_executed)
+                    if difference is not None:
+                        failures += 1
+                        print("DIFF    {} {}".format(name, difference))
+    print("{} failures in {:.2f} sec".format(failures, time.perf_counter() - start))
+    return failures
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Golden frame regression suite over bundled test ROMs')
+    parser.add_argument('roms', nargs='*', metavar='ROM_PATH',
+                        help='ROMs to check (default: all ROMs in {})'.format(ROM_DIRECTORY))
+    parser.add_argument('--engine', action='append', choices=sorted(ENGINES),
+                        help='engine to check, can be repeated (default: all)')
+    parser.add_argument('--quirks', action='append', choices=sorted(QUIRKS),
+                        help='quirk setting to check, can be repeated (default: all)')
+    parser.add_argument('--update', action='store_true',
+                        help='write golden images from first engine instead of checking')
+    args = parser.parse_args()
+    roms = args.roms or sorted(os.path.join(ROM_DIRECTORY, name) for name in os.listdir(ROM_DIRECTORY))
+    sys.exit(1 if main(roms, args.engine or list(ENGINES), args.quirks or list(QUIRKS), args.update) else 0)
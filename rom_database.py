@@ -0,0 +1,159 @@
+__author__ = 'jaya'
+
+# External imports
+import hashlib
+import json
+import os
+import tempfile
+
+# Local imports
+from log import create_logger
+from analysis import analyze_program, ProgramAnalysis
+
+# Setup logger
+logger = create_logger(__name__)
+
+# Set logging level
+DEBUG = 10
+NOTSET = 0
+logger.setLevel(NOTSET)
+
+# Constants
+BASE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+# Curated per ROM settings, keyed by SHA-1 of ROM contents
+DATABASE_PATH = os.path.join(BASE_DIRECTORY, 'rom_database.json')
+# Analysis results of ROMs seen so far, keyed by SHA-1 of ROM contents. Kept in the
+# user's cache directory, not in the source tree, which may be shared or read-only.
+CACHE_DIRECTORY = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'),
+                               'chip8')
+CACHE_PATH = os.path.join(CACHE_DIRECTORY, 'rom_cache.json')
+DEFAULT_INSTRUCTIONS_PER_FRAME = 10
+DEFAULT_QUIRKS = {
+    'shift_Vy': False
+}
+
+def rom_hash(contents):
+    return hashlib.sha1(contents).hexdigest()
+
+
+class RomSettings(object):
+    def __init__(self, sha1, name=None, quirks=None, instructions_per_frame=DEFAULT_INSTRUCTIONS_PER_FRAME,
+                 analysis=None, known=False):
+        """
+        Settings and analysis for one ROM.
+        :param sha1: SHA-1 of ROM contents
+        :param name: name of the ROM in database
+        :param quirks: dict of quirk name -> value. See DEFAULT_QUIRKS.
+        :param instructions_per_frame: instructions to execute per 60 Hz frame
+        :param analysis: ProgramAnalysis
+        :param known: True if ROM is in the database
+        """
+        self.sha1 = sha1
+        self.name = name
+        self.quirks = dict(DEFAULT_QUIRKS)
+        self.quirks.update(quirks or {})
+        self.instructions_per_frame = instructions_per_frame
+        self.analysis = analysis
+        self.known = known
+
+
+class RomDatabase(object):
+    def __init__(self, database_path=DATABASE_PATH, cache_path=CACHE_PATH):
+        """
+        Load ROM database and analysis cache. Both are read once, the
+        cache is written back only when a new ROM was analyzed. The cache is
+        best effort: errors reading or writing it are logged and ROMs are analyzed again.
+        :param database_path: path to JSON database of ROM settings
+        :param cache_path: path to JSON analysis cache. Caching is off if None.
+        """
+        self.database_path = database_path
+        self.cache_path = cache_path
+        self.roms = self.read_json(database_path).get('roms', {})
+        self.cache = self.load_cache()
+        logger.debug("Loaded {} ROM settings and {} cached analyses".format(len(self.roms), len(self.cache)))
+
+    @staticmethod
+    def read_json(path):
+        if not path or not os.path.exists(path):
+            return {}
+        with open(path) as fh:
+            return json.load(fh)
+
+    def load_cache(self):
+        """
+        Read analysis cache. A missing, unreadable or corrupt cache is treated as empty.
+        :return: dict of SHA-1 -> analysis dict
+        """
+        if not self.cache_path:
+            return {}
+        try:
+            cache = self.read_json(self.cache_path)
+        except (ValueError, OSError) as error:
+            logger.warning("Ignoring analysis cache {}: {}".format(self.cache_path, error))
+            return {}
+        roms = cache.get('roms', {}) if isinstance(cache, dict) else None
+        if not isinstance(roms, dict):
+            logger.warning("Ignoring analysis cache {}: unexpected format".format(self.cache_path))
+            return {}
+        return roms
+
+    def save_cache(self):
+        """
+        Write analysis cache to disk. Written to a unique temporary file first and
+        renamed, so concurrent instances never see a partly written cache.
+        :return: None
+        """
+        if not self.cache_path:
+            return
+        directory = os.path.dirname(os.path.abspath(self.cache_path))
+        try:
+            os.makedirs(directory, exist_ok=True)
+            handle, temporary_path = tempfile.mkstemp(dir=directory, prefix='.rom_cache.', suffix='.tmp')
+            try:
+                with os.fdopen(handle, 'w') as fh:
+                    json.dump({'roms': self.cache}, fh, separators=(',', ':'))
+                os.replace(temporary_path, self.cache_path)
+            finally:
+                if os.path.exists(temporary_path):
+                    os.remove(temporary_path)
+        except OSError as error:
+            logger.warning("Can not save analysis cache {}: {}".format(self.cache_path, error))
+
+    def lookup(self, contents):
+        """
+        Get settings for ROM, analyzing it if analysis is not cached.
+        :param contents: ROM contents
+        :return: RomSettings
+        """
+        sha1 = rom_hash(contents)
+        entry = self.roms.get(sha1, {})
+        analysis = None
+        if sha1 in self.cache:
+            try:
+                analysis = ProgramAnalysis.from_dict(self.cache[sha1])
+            except (AttributeError, KeyError, TypeError, ValueError) as error:
+                logger.warning("Ignoring cached analysis of ROM {}: {!r}".format(sha1, error))
+        if analysis is None:
+            logger.debug("Analyzing ROM {}".format(sha1))
+            analysis = analyze_program(contents)
+            self.cache[sha1] = analysis.to_dict()
+            self.save_cache()
+        return RomSettings(sha1, name=entry.get('name'), quirks=entry.get('quirks'),
+                           instructions_per_frame=entry.get('instructions_per_frame', DEFAULT_INSTRUCTIONS_PER_FRAME),
+                           analysis=analysis, known=sha1 in self.roms)
+
+    def configure_cpu(self, cpu, binary):
+        """
+        Apply quirks and analysis of given ROM to CPU. ROM itself is not loaded.
+        :param cpu: CPU object
+        :param binary: path to ROM
+        :return: RomSettings
+        """
+        with open(binary, 'rb') as fh:
+            settings = self.lookup(fh.read())
+        for name, value in settings.quirks.items():
+            setattr(cpu, name, value)
+        cpu.analysis = settings.analysis
+        logger.debug("ROM {} ({}): quirks {}, {} instructions per frame".format(
+            binary, settings.name or 'unknown', settings.quirks, settings.instructions_per_frame))
+        return settings
@@ -0,0 +1,623 @@
+__author__ = 'jaya'
+
+# External imports
+import argparse
+import asyncio
+import base64
+import hashlib
+import os
+import struct
+import sys
+import tempfile
+import time
+import zlib
+
+# Local imports
+from log import create_logger
+from display import Chip8Screen
+from cpu import CPU, ENGINES
+from rom_database import RomDatabase
+from app import load_rom, FRAME_TIME
+
+# Setup logger
+logger = create_logger(__name__)
+
+# Set logging level
+DEBUG = 10
+NOTSET = 0
+logger.setLevel(NOTSET)
+
+# Protocol. Every message is sent as one WebSocket binary frame, or over plain
+# TCP as u32 little endian length followed by the message. TCP clients must
+# send a message (usually OPTIONS) first, WebSocket clients start with the
+# HTTP upgrade request. A plain HTTP GET returns a small browser client.
+#
+# Server to client:
+#   'H' version(B) width(B) height(B)                 - hello, sent once
+#   'F' frame(I) flags(B) rows                        - framebuffer delta
+#       rows: changed rows, each row index(B) followed by width/8 bytes of
+#       pixels, most significant bit first. zlib compressed if flags & 1.
+# Client to server:
+#   'K' key(B) pressed(B)                             - CHIP-8 key 0x0-0xF down/up
+#   'O' flags(B)                                      - options, flags & 1 asks for compression
+#   'L' name                                          - load ROM by name from ROM directory
+PROTOCOL_VERSION = 1
+HELLO_FORMAT = '<cBBB'
+FRAME_HEADER_FORMAT = '<cIB'
+FLAG_COMPRESSED = 0x01
+DEFAULT_PORT = 8008
+MAX_MESSAGE_SIZE = 1024  # from clients
+SEND_BUFFER_SIZE = 64 * 1024  # per client, frames are coalesced while it is full
+WEBSOCKET_GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+# ROMs of selftest. One flips a pixel every frame at 2 instructions per frame,
+# the other writes past the end of memory (LD I, 0xFFF then LD [I], VF).
+SELFTEST_BLINKING_ROM = bytes([0xA2, 0x06, 0xD0, 0x01, 0x12, 0x02, 0x80, 0x00])
+SELFTEST_FAULTING_ROM = bytes([0xAF, 0xFF, 0xFF, 0x55, 0x12, 0x04])
+BROWSER_CLIENT = b"""<!DOCTYPE html>
+<html><head><title>CHIP-8</title></head>
+<body style="background: #222">
+<canvas id="screen" width="640" height="320"></canvas>
+<script>
+const keys = {'1': 1, '2': 2, '3': 3, '4': 12, 'q': 4, 'w': 5, 'e': 6, 'r': 13,
+              'a': 7, 's': 8, 'd': 9, 'f': 14, 'z': 10, 'x': 0, 'c': 11, 'v': 15};
+const canvas = document.getElementById('screen');
+const context = canvas.getContext('2d');
+let width = 64, rowBytes = 8, scale = 10;
+const socket = new WebSocket('ws://' + location.host + '/');
+socket.binaryType = 'arraybuffer';
+socket.onmessage = function (event) {
+  const data = new Uint8Array(event.data);
+  if (data[0] == 0x48) {
+    width = data[2]; rowBytes = width / 8; scale = canvas.width / width;
+    canvas.height = data[3] * scale;
+    return;
+  }
+  for (let offset = 6; data[0] == 0x46 && offset < data.length; offset += 1 + rowBytes) {
+    const y = data[offset];
+    for (let x = 0; x < width; x++) {
+      context.fillStyle = data[offset + 1 + (x >> 3)] & (0x80 >> (x & 7)) ? '#000' : '#fff';
+      context.fillRect(x * scale, y * scale, scale, scale);
+    }
+  }
+};
+function sendKey(event, pressed) {
+  const key = keys[event.key.toLowerCase()];
+  if (key !== undefined && !event.repeat && socket.readyState == 1) {
+    socket.send(new Uint8Array([0x4b, key, pressed]));
+  }
+}
+document.onkeydown = function (event) { sendKey(event, 1); };
+document.onkeyup = function (event) { sendKey(event, 0); };
+</script>
+</body></html>
+"""
+
+def pack_rows(buffer, previous, width, height):
+    """
+    Bit pack rows of display buffer which differ from previous buffer.
+    :param buffer: display buffer, one byte per pixel
+    :param previous: display buffer known to client, or None to pack all rows
+    :return: bytes, row index followed by width/8 bytes for each changed row
+    """
+    packed = bytearray()
+    for y in range(height):
+        start = y * width
+        row = buffer[start: start + width]
+        if previous is not None and row == previous[start: start + width]:
+            continue
+        packed.append(y)
+        for x in range(0, width, 8):
+            byte = 0
+            for pixel in row[x: x + 8]:
+                byte = (byte << 1) | (1 if pixel else 0)
+            packed.append(byte)
+    return bytes(packed)
+
+def unpack_rows(packed, buffer, width):
+    """
+    Apply rows made by pack_rows to display buffer
+    :return: None
+    """
+    step = 1 + width // 8
+    for offset in range(0, len(packed), step):
+        start = packed[offset] * width
+        for x in range(width):
+            buffer[start + x] = (packed[offset + 1 + (x >> 3)] >> (7 - (x & 7))) & 1
+
+
+class TcpConnection(object):
+    def __init__(self, reader, writer):
+        """
+        Messages framed by u32 length prefix
+        """
+        self.reader = reader
+        self.writer = writer
+
+    async def read_message(self):
+        """
+        :return: message bytes, or None when connection is closed
+        """
+        try:
+            size, = struct.unpack('<I', await self.reader.readexactly(4))
+            if size > MAX_MESSAGE_SIZE:
+                logger.debug("Message of {} bytes is too big".format(size))
+                return None
+            return await self.reader.readexactly(size)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            return None
+
+    def write_message(self, message):
+        self.writer.write(struct.pack('<I', len(message)) + message)
+
+
+class WebSocketConnection(object):
+    def __init__(self, reader, writer):
+        """
+        Messages sent as WebSocket (RFC 6455) binary frames. Handshake is done by Server.
+        """
+        self.reader = reader
+        self.writer = writer
+
+    async def read_message(self):
+        """
+        Read next binary or text message, answering pings on the way.
+        :return: message bytes, or None when connection is closed
+        """
+        try:
+            while True:
+                first, second = await self.reader.readexactly(2)
+                opcode = first & 0x0f
+                size = second & 0x7f
+                if size == 126:
+                    size, = struct.unpack('>H', await self.reader.readexactly(2))
+                elif size == 127:
+                    size, = struct.unpack('>Q', await self.reader.readexactly(8))
+                if size > MAX_MESSAGE_SIZE or not first & 0x80 or not second & 0x80:
+                    # fragmented or unmasked client frames are not used by this protocol
+                    return None
+                mask = await self.reader.readexactly(4)
+                payload = bytes(byte ^ mask[index & 3] for index, byte in enumerate(await self.reader.readexactly(size)))
+                if opcode == 0x8:  # close
+                    return None
+                if opcode == 0x9:  # ping
+                    self.write_frame(0xA, payload)
+                elif opcode in (0x1, 0x2):
+                    return payload
+        except (asyncio.IncompleteReadError, ConnectionError):
+            return None
+
+    def write_frame(self, opcode, payload):
+        size = len(payload)
+        if size < 126:
+            header = struct.pack('>BB', 0x80 | opcode, size)
+        elif size < 0x10000:
+            header = struct.pack('>BBH', 0x80 | opcode, 126, size)
+        else:
+            header = struct.pack('>BBQ', 0x80 | opcode, 127, size)
+        self.writer.write(header + payload)
+
+    def write_message(self, message):
+        self.write_frame(0x2, message)
+
+
+class Session(object):
+    def __init__(self, server, connection, binary):
+        """
+        Headless CPU running for one client.
+        :param server: Server object
+        :param connection: TcpConnection or WebSocketConnection
+        :param binary: path to ROM
+        """
+        self.server = server
+        self.connection = connection
+        self.cpu = CPU(binary=binary, screen=Chip8Screen(), sound=None)
+        self.cpu.realtime_timers = False
+        self.cpu.set_engine(server.engine)
+        self.instructions_per_frame = load_rom(self.cpu, server.database, binary, server.instructions_per_frame)
+        self.frame = 0
+        self.compress = False
+        self.sent = None  # display buffer as last sent to client
+        self.frame_ready = asyncio.Event()
+        self.frame_ready.set()
+
+    def run_frame(self):
+        """
+        Execute one frame and wake up sender if display changed
+        :return: None
+        """
+        cpu = self.cpu
+        if cpu.is_running:
+            cpu.run_frame(self.instructions_per_frame)
+        self.frame += 1
+        if cpu.screen.needs_screen_update:
+            cpu.screen.mark_frame_drawn()
+            self.frame_ready.set()
+
+    def close(self):
+        """
+        Stop running this session and disconnect its client. handle_client cleans up the rest.
+        :return: None
+        """
+        self.server.sessions.discard(self)
+        self.connection.writer.close()
+
+    def make_delta(self):
+        """
+        Build frame message with rows changed since last sent frame
+        :return: message bytes or None if nothing changed
+        """
+        screen = self.cpu.screen
+        rows = pack_rows(screen.display_buffer, self.sent, screen.width, screen.height)
+        if not rows:
+            return None
+        self.sent = bytes(screen.display_buffer)
+        flags = 0
+        if self.compress:
+            compressed = zlib.compress(rows, 1)
+            if len(compressed) < len(rows):
+                rows = compressed
+                flags |= FLAG_COMPRESSED
+        return struct.pack(FRAME_HEADER_FORMAT, b'F', self.frame & 0xffffffff, flags) + rows
+
+    async def send_frames(self):
+        """
+        Send deltas to client. While the client's send buffer is full, frames
+        are not queued: the next delta covers every change since the last one sent.
+        :return: None
+        """
+        screen = self.cpu.screen
+        self.connection.write_message(struct.pack(HELLO_FORMAT, b'H', PROTOCOL_VERSION, screen.width, screen.height))
+        while True:
+            await self.frame_ready.wait()
+            self.frame_ready.clear()
+            message = self.make_delta()
+            if message:
+                self.connection.write_message(message)
+                await self.connection.writer.drain()
+
+    def handle_message(self, message):
+        """
+        Handle message from client
+        :param message: message bytes
+        :return: None
+        """
+        kind = message[:1]
+        if kind == b'K' and len(message) == 3:
+            self.cpu.keys_pressed[message[1] & 0x0f] = 1 if message[2] else 0
+        elif kind == b'O' and len(message) == 2:
+            self.compress = bool(message[1] & FLAG_COMPRESSED)
+        elif kind == b'L':
+            name = os.path.basename(message[1:].decode('utf-8', 'replace'))
+            binary = os.path.join(self.server.rom_directory, name)
+            if not name or not os.path.isfile(binary):
+                logger.debug("Unknown ROM {}".format(name))
+                return
+            try:
+                self.instructions_per_frame = load_rom(self.cpu, self.server.database, binary,
+                                                       self.server.instructions_per_frame)
+            except Exception as error:
+                logger.error("Can not load {}, keeping current ROM: {}".format(name, error))
+                return
+            self.sent = None
+            self.frame_ready.set()
+        else:
+            logger.debug("Unknown message {}".format(message[:16]))
+
+
+class Server(object):
+    def __init__(self, binary, rom_directory='roms', engine='reference', instructions_per_frame=None, max_sessions=64):
+        """
+        Serve headless emulator sessions over WebSocket and plain TCP on one port.
+        All sessions are run by one 60 Hz task, so a slow client never delays emulation.
+        :param binary: ROM loaded for new sessions
+        :param rom_directory: directory clients can load ROMs from by name
+        :param engine: one of cpu.ENGINES
+        :param instructions_per_frame: overrides ROM database value if not None
+        :param max_sessions: connections over this limit are closed
+        """
+        self.binary = binary
+        self.rom_directory = rom_directory
+        self.engine = engine
+        self.instructions_per_frame = instructions_per_frame
+        self.max_sessions = max_sessions
+        self.database = RomDatabase()
+        self.sessions = set()
+
+    async def run_sessions(self):
+        """
+        Run one frame of every session at 60 Hz. If running late, do not try to catch up.
+        A session whose ROM faults is closed, the others keep running.
+        :return: None
+        """
+        next_frame_time = time.perf_counter()
+        while True:
+            for session in list(self.sessions):
+                try:
+                    session.run_frame()
+                except Exception as error:
+                    logger.error("Session faulted at 0x{:03X}, closing it: {!r}".format(
+                        session.cpu.program_counter, error))
+                    session.close()
+            next_frame_time += FRAME_TIME
+            delay = next_frame_time - time.perf_counter()
+            if delay < 0:
+                next_frame_time = time.perf_counter()
+                delay = 0
+            await asyncio.sleep(delay)
+
+    async def handshake(self, reader, writer):
+        """
+        Complete WebSocket upgrade, or answer plain HTTP request with browser client.
+        'GET ' is already read.
+        :return: True if connection was upgraded to WebSocket
+        """
+        request = await reader.readuntil(b'\r\n\r\n')
+        headers = dict()
+        for line in request.split(b'\r\n')[1:]:
+            if b':' in line:
+                name, value = line.split(b':', 1)
+                headers[name.strip().lower()] = value.strip()
+        key = headers.get(b'sec-websocket-key')
+        if key is None or headers.get(b'upgrade', b'').lower() != b'websocket':
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/html\r\nContent-Length: ' +
+                         str(len(BROWSER_CLIENT)).encode() + b'\r\nConnection: close\r\n\r\n' + BROWSER_CLIENT)
+            await writer.drain()
+            return False
+        accept = base64.b64encode(hashlib.sha1(key + WEBSOCKET_GUID).digest())
+        writer.write(b'HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+                     b'Sec-WebSocket-Accept: ' + accept + b'\r\n\r\n')
+        return True
+
+    async def handle_client(self, reader, writer):
+        """
+        Run a session for one client until it disconnects
+        :return: None
+        """
+        peer = writer.get_extra_info('peername')
+        writer.transport.set_write_buffer_limits(high=SEND_BUFFER_SIZE)
+        sender = None
+        session = None
+        try:
+            start = await asyncio.wait_for(reader.readexactly(4), timeout=10)
+            first_message = None
+            if start == b'GET ':
+                if not await asyncio.wait_for(self.handshake(reader, writer), timeout=10):
+                    return
+                connection = WebSocketConnection(reader, writer)
+            else:
+                connection = TcpConnection(reader, writer)
+                size, = struct.unpack('<I', start)
+                if size > MAX_MESSAGE_SIZE:
+                    return
+                first_message = await reader.readexactly(size)
+            if len(self.sessions) >= self.max_sessions:
+                logger.debug("Too many sessions, closing connection from {}".format(peer))
+                return
+            session = Session(self, connection, self.binary)
+            if first_message:
+                session.handle_message(first_message)
+            self.sessions.add(session)
+            logger.debug("Session started for {}".format(peer))
+            sender = asyncio.ensure_future(session.send_frames())
+            while True:
+                message = await connection.read_message()
+                if message is None or sender.done():
+                    break
+                session.handle_message(message)
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            self.sessions.discard(session)
+            if sender:
+                sender.cancel()
+            writer.close()
+            logger.debug("Session ended for {}".format(peer))
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handle_client, host, port)
+        print("Serving {} on {}:{}".format(self.binary, host, port))
+        async with server:
+            await asyncio.gather(server.serve_forever(), self.run_sessions())
+
+
+class RemoteClient(object):
+    def __init__(self, reader, writer, websocket=False):
+        """
+        Client for Server, keeps a local copy of the remote framebuffer.
+        Use RemoteClient.connect to create one.
+        """
+        self.reader = reader
+        self.writer = writer
+        self.websocket = websocket
+        self.width = 0
+        self.height = 0
+        self.display_buffer = bytearray()
+        self.frame = 0
+        self.bytes_received = 0
+
+    @staticmethod
+    async def connect(host, port, websocket=False, compress=False):
+        """
+        Connect to server and read hello message
+        :return: RemoteClient
+        """
+        reader, writer = await asyncio.open_connection(host, port)
+        client = RemoteClient(reader, writer, websocket)
+        if websocket:
+            key = base64.b64encode(os.urandom(16))
+            writer.write(b'GET / HTTP/1.1\r\nHost: ' + host.encode() + b'\r\nUpgrade: websocket\r\n'
+                         b'Connection: Upgrade\r\nSec-WebSocket-Version: 13\r\nSec-WebSocket-Key: ' + key + b'\r\n\r\n')
+            response = await reader.readuntil(b'\r\n\r\n')
+            if not response.startswith(b'HTTP/1.1 101'):
+                raise ConnectionError("WebSocket upgrade failed")
+        client.send(struct.pack('<cB', b'O', FLAG_COMPRESSED if compress else 0))
+        await client.receive()
+        return client
+
+    def send(self, message):
+        if self.websocket:
+            mask = os.urandom(4)
+            masked = bytes(byte ^ mask[index & 3] for index, byte in enumerate(message))
+            if len(message) < 126:
+                header = struct.pack('>BB', 0x82, 0x80 | len(message))
+            else:
+                header = struct.pack('>BBH', 0x82, 0x80 | 126, len(message))
+            self.writer.write(header + mask + masked)
+        else:
+            self.writer.write(struct.pack('<I', len(message)) + message)
+
+    def send_key(self, key, pressed):
+        self.send(struct.pack('<cBB', b'K', key, 1 if pressed else 0))
+
+    def load_rom(self, name):
+        self.send(b'L' + name.encode('utf-8'))
+
+    async def read_message(self):
+        if self.websocket:
+            first, second = await self.reader.readexactly(2)
+            size = second & 0x7f
+            if size == 126:
+                size, = struct.unpack('>H', await self.reader.readexactly(2))
+            elif size == 127:
+                size, = struct.unpack('>Q', await self.reader.readexactly(8))
+        else:
+            size, = struct.unpack('<I', await self.reader.readexactly(4))
+        self.bytes_received += size
+        return await self.reader.readexactly(size)
+
+    async def receive(self):
+        """
+        Read one message and apply it to local framebuffer
+        :return: message type, b'H' or b'F'
+        """
+        message = await self.read_message()
+        kind = message[:1]
+        if kind == b'H':
+            _, _, self.width, self.height = struct.unpack(HELLO_FORMAT, message)
+            self.display_buffer = bytearray(self.width * self.height)
+        elif kind == b'F':
+            _, self.frame, flags = struct.unpack_from(FRAME_HEADER_FORMAT, message)
+            rows = message[struct.calcsize(FRAME_HEADER_FORMAT):]
+            if flags & FLAG_COMPRESSED:
+                rows = zlib.decompress(rows)
+            unpack_rows(rows, self.display_buffer, self.width)
+        return kind
+
+    def close(self):
+        self.writer.close()
+
+async def run_client(host, port, websocket, compress, seconds):
+    """
+    Loopback client: watch a session for some time and print last frame and traffic
+    :return: None
+    """
+    client = await RemoteClient.connect(host, port, websocket, compress)
+    messages = 0
+    end = time.perf_counter() + seconds
+    try:
+        while True:
+            remaining = end - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                await asyncio.wait_for(client.receive(), timeout=remaining)
+            except asyncio.TimeoutError:
+                break
+            messages += 1
+    finally:
+        client.close()
+    for y in range(client.height):
+        print(''.join('x' if pixel else ' ' for pixel in client.display_buffer[y * client.width: (y + 1) * client.width]))
+    print("{} frame messages, {} bytes, last frame {}".format(messages, client.bytes_received, client.frame))
+
+async def run_selftest():
+    """
+    Loopback check that a faulting session does not stop the others: one client
+    loads a ROM that faults, another must keep receiving frames.
+    :return: True if check passed
+    """
+    with tempfile.TemporaryDirectory() as rom_directory:
+        for name, contents in (('blink.ch8', SELFTEST_BLINKING_ROM), ('fault.ch8', SELFTEST_FAULTING_ROM)):
+            with open(os.path.join(rom_directory, name), 'wb') as fh:
+                fh.write(contents)
+        server = Server(os.path.join(rom_directory, 'blink.ch8'), rom_directory, instructions_per_frame=2)
+        listener = await asyncio.start_server(server.handle_client, '127.0.0.1', 0)
+        port = listener.sockets[0].getsockname()[1]
+        runner = asyncio.ensure_future(server.run_sessions())
+        clients = list()
+        try:
+            watcher = await RemoteClient.connect('127.0.0.1', port)
+            clients.append(watcher)
+            faulting = await RemoteClient.connect('127.0.0.1', port, websocket=True)
+            clients.append(faulting)
+            faulting.load_rom('fault.ch8')
+            disconnected = False
+            try:
+                while True:
+                    await asyncio.wait_for(faulting.receive(), timeout=2)
+            except (asyncio.IncompleteReadError, ConnectionError):
+                disconnected = True
+            except asyncio.TimeoutError:
+                pass
+            first_frame = watcher.frame
+            frames = 0
+            end = time.perf_counter() + 0.5
+            try:
+                while time.perf_counter() < end:
+                    if await asyncio.wait_for(watcher.receive(), timeout=1) == b'F':
+                        frames += 1
+            except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                pass
+            loop_running = not runner.done()
+            sessions_left = len(server.sessions)
+        finally:
+            for client in clients:
+                client.close()
+            # Let handlers see the disconnects before the event loop is closed
+            for _ in range(100):
+                if not server.sessions:
+                    break
+                await asyncio.sleep(0.01)
+            runner.cancel()
+            listener.close()
+    checks = (
+        ("faulting client was disconnected", disconnected),
+        ("session loop is still running", loop_running),
+        ("other client received {} frames ({} -> {}) in 0.5 sec".format(frames, first_frame, watcher.frame),
+         frames >= 10 and watcher.frame > first_frame),
+        ("{} session left, 1 expected".format(sessions_left), sessions_left == 1),
+    )
+    for description, passed in checks:
+        print("{}  {}".format('PASS' if passed else 'FAIL', description))
+    return all(passed for _, passed in checks)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve headless CHIP-8 sessions over WebSocket and TCP')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    serve_parser = subparsers.add_parser('serve', help='run server')
+    serve_parser.add_argument('rom', metavar='ROM_PATH', help='ROM loaded for new sessions')
+    serve_parser.add_argument('--host', default='127.0.0.1', help='(default: 127.0.0.1)')
+    serve_parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='(default: {})'.format(DEFAULT_PORT))
+    serve_parser.add_argument('--rom-directory', default='roms', help='ROMs clients can load by name (default: roms)')
+    serve_parser.add_argument('--engine', choices=ENGINES, default='reference', help='(default: reference)')
+    serve_parser.add_argument('--instructions-per-frame', metavar='N', type=int, default=None,
+                              help='(default: from ROM database, else 10)')
+    serve_parser.add_argument('--max-sessions', type=int, default=64, help='(default: 64)')
+    connect_parser = subparsers.add_parser('connect', help='loopback client, prints last received frame')
+    connect_parser.add_argument('--host', default='127.0.0.1', help='(default: 127.0.0.1)')
+    connect_parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='(default: {})'.format(DEFAULT_PORT))
+    connect_parser.add_argument('--websocket', action='store_true', help='connect with WebSocket instead of TCP')
+    connect_parser.add_argument('--compress', action='store_true', help='ask for compressed deltas')
+    connect_parser.add_argument('--seconds', type=float, default=2, help='time to watch (default: 2)')
+    subparsers.add_parser('selftest', help='check on a loopback server that a faulting session does not stop others')
+    args = parser.parse_args()
+    try:
+        if args.command == 'serve':
+            server = Server(args.rom, args.rom_directory, args.engine, args.instructions_per_frame, args.max_sessions)
+            asyncio.run(server.serve(args.host, args.port))
+        elif args.command == 'selftest':
+            sys.exit(0 if asyncio.run(run_selftest()) else 1)
+        else:
+            asyncio.run(run_client(args.host, args.port, args.websocket, args.compress, args.seconds))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,219 @@
+__author__ = 'jaya'
+
+# External imports
+import os
+import struct
+import sys
+import time
+from multiprocessing import shared_memory, resource_tracker
+
+# Local imports
+from log import create_logger
+
+# Setup logger
+logger = create_logger(__name__)
+
+# Set logging level
+DEBUG = 10
+NOTSET = 0
+logger.setLevel(NOTSET)
+
+# Shared memory layout (all values little endian)
+#   0  magic(4s) version(H) width(H) height(H) reserved(6x)  - header, written once
+#  16  sequence(Q)                                           - seqlock counter, odd while writing
+#  24  frame counter(Q)
+#  32  PC(H) I(H) delay timer(B) sound timer(B) stack depth(B) reserved(x)
+#  40  V0..VF(16s)
+#  56  reserved(8x)
+#  64  framebuffer, one byte per pixel (0 or 1), row major
+MAGIC = b'CH8S'
+VERSION = 1
+HEADER_FORMAT = '<4sHHH6x'
+SEQUENCE_FORMAT = '<Q'
+STATE_FORMAT = '<QHHBBBx16s'
+SEQUENCE_OFFSET = 16
+STATE_OFFSET = 24
+FRAMEBUFFER_OFFSET = 64
+# Seconds a reader waits for a write to finish. A publish takes microseconds, an odd
+# sequence that lasts this long means the publisher died in the middle of a write.
+READ_TIMEOUT = 1.0
+
+
+class SharedState(object):
+    def __init__(self, sequence, frame, program_counter, i, delay_timer, sound_timer, stack_depth, v, framebuffer):
+        """
+        Consistent snapshot of the published emulator state.
+        :param sequence: seqlock sequence number the snapshot was taken at
+        :param frame: frame counter
+        :param framebuffer: bytes, one byte per pixel
+        """
+        self.sequence = sequence
+        self.frame = frame
+        self.program_counter = program_counter
+        self.i = i
+        self.delay_timer = delay_timer
+        self.sound_timer = sound_timer
+        self.stack_depth = stack_depth
+        self.v = v
+        self.framebuffer = framebuffer
+
+
+class SharedStatePublisher(object):
+    def __init__(self, name=None, width=64, height=32):
+        """
+        Create a shared memory block and publish emulator state into it.
+        Other processes attach to it by name with SharedStateReader.
+        :param name: name of shared memory block. A random name is used if None.
+        :param width: width of the framebuffer
+        :param height: height of the framebuffer
+        """
+        self.width = width
+        self.height = height
+        self.framebuffer_size = width * height
+        size = FRAMEBUFFER_OFFSET + self.framebuffer_size
+        self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        self.name = self.shm.name
+        self.buffer = self.shm.buf
+        self.sequence = 0
+        self.frame = 0
+        struct.pack_into(HEADER_FORMAT, self.buffer, 0, MAGIC, VERSION, width, height)
+        struct.pack_into(SEQUENCE_FORMAT, self.buffer, SEQUENCE_OFFSET, self.sequence)
+        logger.debug("Publishing state to shared memory {}".format(self.name))
+
+    def publish(self, cpu):
+        """
+        Copy registers and framebuffer of given CPU to shared memory and
+        increment frame counter. Readers never block the writer, they retry
+        if sequence number changed while they were reading.
+        :param cpu: CPU object
+        :return: None
+        """
+        registers = cpu.registers
+        self.frame += 1
+        # odd sequence - write in progress
+        self.sequence += 1
+        struct.pack_into(SEQUENCE_FORMAT, self.buffer, SEQUENCE_OFFSET, self.sequence)
+        struct.pack_into(STATE_FORMAT, self.buffer, STATE_OFFSET, self.frame,
+                         cpu.program_counter & 0xFFFF, registers.i & 0xFFFF,
+                         registers.delay_timer, registers.sound_timer,
+                         min(max(cpu.stack_depth(), 0), 0xFF), registers.v)
+        self.buffer[FRAMEBUFFER_OFFSET: FRAMEBUFFER_OFFSET + self.framebuffer_size] = cpu.screen.display_buffer
+        # even sequence - write complete
+        self.sequence += 1
+        struct.pack_into(SEQUENCE_FORMAT, self.buffer, SEQUENCE_OFFSET, self.sequence)
+
+    def close(self):
+        """
+        Release and remove shared memory block
+        :return: None
+        """
+        self.buffer = None
+        self.shm.close()
+        self.shm.unlink()
+
+
+class SharedStateReader(object):
+    def __init__(self, name):
+        """
+        Attach to shared memory block created by SharedStatePublisher.
+        :param name: name of shared memory block
+        """
+        # Attaching registers the block with this process's resource tracker which
+        # would unlink it on exit. Block is owned by the publisher, so avoid that.
+        if sys.version_info >= (3, 13):
+            self.shm = shared_memory.SharedMemory(name=name, create=False, track=False)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name, create=False)
+            if os.name == 'posix':
+                # POSIX shared memory names start with '/'. SharedMemory.name leaves it
+                # out, but the block was registered with the tracker under the full name.
+                resource_tracker.unregister('/' + self.shm.name, 'shared_memory')
+        self.buffer = self.shm.buf
+        magic, version, self.width, self.height = struct.unpack_from(HEADER_FORMAT, self.buffer, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise Exception("{} is not a CHIP-8 state block (version {})".format(name, VERSION))
+        self.framebuffer_size = self.width * self.height
+        self.framebuffer = self.buffer[FRAMEBUFFER_OFFSET: FRAMEBUFFER_OFFSET + self.framebuffer_size]
+
+    def begin_read(self, timeout=READ_TIMEOUT):
+        """
+        Wait until no write is in progress and return current sequence number.
+        Use it together with end_read to process self.framebuffer zero-copy.
+        :param timeout: seconds to wait for a write in progress
+        :return: sequence number
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            sequence = struct.unpack_from(SEQUENCE_FORMAT, self.buffer, SEQUENCE_OFFSET)[0]
+            if not sequence & 1:
+                return sequence
+            if time.monotonic() > deadline:
+                raise Exception("Write to shared memory {} did not finish, "
+                                "publisher stopped in the middle of a write".format(self.shm.name))
+            time.sleep(0)
+
+    def end_read(self, sequence):
+        """
+        Check whether data read since begin_read is consistent.
+        :param sequence: sequence number returned by begin_read
+        :return: True if nothing was written in between, else False.
+        """
+        return struct.unpack_from(SEQUENCE_FORMAT, self.buffer, SEQUENCE_OFFSET)[0] == sequence
+
+    def read(self, timeout=READ_TIMEOUT):
+        """
+        Read a consistent copy of the published state.
+        :param timeout: seconds to wait for a write in progress
+        :return: SharedState
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            sequence = self.begin_read(max(deadline - time.monotonic(), 0))
+            state = struct.unpack_from(STATE_FORMAT, self.buffer, STATE_OFFSET)
+            framebuffer = bytes(self.framebuffer)
+            if self.end_read(sequence):
+                return SharedState(sequence, *(state + (framebuffer,)))
+
+    def close(self):
+        """
+        Detach from shared memory block. Block itself is owned by the publisher.
+        :return: None
+        """
+        if hasattr(self, 'framebuffer'):
+            self.framebuffer.release()
+        self.buffer = None
+        self.shm.close()
+
+
+def watch(name, interval=1/30):
+    """
+    Print published frames to console whenever frame counter changes.
+    :param name: name of shared memory block
+    :param interval: polling interval in seconds
+    :return: None
+    """
+    reader = SharedStateReader(name)
+    last_frame = None
+    try:
+        while True:
+            state = reader.read()
+            if state.frame != last_frame:
+                last_frame = state.frame
+                lines = ["Frame: {} PC: 0x{:04X} I: 0x{:04X} DT: {} ST: {}".format(
+                    state.frame, state.program_counter, state.i, state.delay_timer, state.sound_timer)]
+                for y in range(reader.height):
+                    row = state.framebuffer[y * reader.width: (y + 1) * reader.width]
+                    lines.append(''.join('x' if pixel else ' ' for pixel in row))
+                print('\n'.join(lines))
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        reader.close()
+
+if __name__ == '__main__':
+    if len(sys.argv) == 2:
+        watch(sys.argv[1])
+    else:
+        print("USAGE: shared_state.py <SHARED_MEMORY_NAME>")
@@ -0,0 +1,263 @@
+__author__ = 'jaya'
+
+# External imports
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Local imports
+from log import create_logger
+
+# Setup logger
+logger = create_logger(__name__)
+
+# Set logging level
+DEBUG = 10
+NOTSET = 0
+logger.setLevel(NOTSET)
+
+# Constants
+FRAME_TIME = 1 / 60
+RATE_INTERVAL = 1.0  # seconds between IPS/FPS updates
+# Histogram bucket upper bounds in seconds
+FRAME_TIME_BUCKETS = (0.004, 0.008, 0.012, 0.0167, 0.02, 0.025, 0.033, 0.05, 0.1, 0.25)
+SECTION_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.002, 0.004, 0.008, 0.0167, 0.033)
+LATENCY_BUCKETS = (0.0167, 0.025, 0.033, 0.05, 0.075, 0.1, 0.15, 0.25, 0.5, 1.0)
+
+class Histogram(object):
+    def __init__(self, name, description, buckets):
+        """
+        Fixed bucket histogram, same model as Prometheus histograms.
+        :param name: metric name
+        :param description: metric help text
+        :param buckets: sorted bucket upper bounds
+        """
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """
+        Upper bound of bucket containing given quantile
+        :param q: quantile between 0 and 1
+        :return: seconds, inf if it is in the last bucket, None if histogram is empty
+        """
+        if not self.count:
+            return None
+        target = q * self.count
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            if total >= target:
+                return bound
+        return float('inf')
+
+    def render(self):
+        lines = ["# HELP {} {}".format(self.name, self.description), "# TYPE {} histogram".format(self.name)]
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            lines.append('{}_bucket{{le="{}"}} {}'.format(self.name, bound, total))
+        lines.append('{}_bucket{{le="+Inf"}} {}'.format(self.name, self.count))
+        lines.append("{}_sum {}".format(self.name, self.sum))
+        lines.append("{}_count {}".format(self.name, self.count))
+        return lines
+
+
+class Telemetry(object):
+    def __init__(self, frame_time=FRAME_TIME):
+        """
+        Frame pacing and input latency metrics of the main loop. The loop calls
+        frame_started, then cpu_finished, render_finished, events_finished and
+        frame_finished in this order once per frame. Nothing is measured when
+        the loop has no Telemetry object.
+        :param frame_time: frame budget in seconds
+        """
+        self.frame_time = frame_time
+        self.start_time = time.perf_counter()
+        self.frame_times = Histogram('chip8_frame_seconds', 'Time between starts of consecutive frames.', FRAME_TIME_BUCKETS)
+        self.cpu_times = Histogram('chip8_cpu_seconds', 'Time spent executing instructions per frame.', SECTION_BUCKETS)
+        self.render_times = Histogram('chip8_render_seconds', 'Time spent drawing, recording and publishing per frame.',
+                                      SECTION_BUCKETS)
+        self.event_times = Histogram('chip8_event_seconds', 'Time spent handling window events per frame.', SECTION_BUCKETS)
+        self.input_latencies = Histogram('chip8_input_latency_seconds',
+                                         'Time from handling key down event to end of next frame that was not skipped.',
+                                         LATENCY_BUCKETS)
+        self.frames = 0
+        self.presented_frames = 0
+        self.skipped_frames = 0
+        self.late_frames = 0
+        self.dropped_frames = 0
+        self.instructions = 0
+        self.frames_per_second = 0.0
+        self.instructions_per_second = 0.0
+        self.frame_start = None
+        self.section_start = None
+        self.key_down_time = None
+        self.rate_time = self.start_time
+        self.rate_frames = 0
+        self.rate_instructions = 0
+
+    def frame_started(self):
+        now = time.perf_counter()
+        if self.frame_start is not None:
+            self.frame_times.observe(now - self.frame_start)
+        self.frame_start = now
+        self.section_start = now
+
+    def cpu_finished(self, instructions):
+        """
+        :param instructions: number of instructions executed in this frame
+        """
+        now = time.perf_counter()
+        self.cpu_times.observe(now - self.section_start)
+        self.section_start = now
+        self.instructions += instructions
+
+    def render_finished(self, presented, skipped=False):
+        """
+        :param presented: True if a frame was drawn
+        :param skipped: True if drawing a changed frame was skipped to keep up
+        """
+        now = time.perf_counter()
+        self.render_times.observe(now - self.section_start)
+        self.section_start = now
+        if skipped:
+            self.skipped_frames += 1
+        if presented:
+            self.presented_frames += 1
+        # The screen shows the result of the key press once the first frame after
+        # it is done, whether that frame changed the screen or not
+        if not skipped and self.key_down_time is not None:
+            self.input_latencies.observe(now - self.key_down_time)
+            self.key_down_time = None
+
+    def events_finished(self):
+        now = time.perf_counter()
+        self.event_times.observe(now - self.section_start)
+        self.section_start = now
+
+    def key_pressed(self):
+        """
+        Key down event was handled. Latency is measured to the end of the next frame
+        that was not skipped, for the first key press since the last measurement.
+        """
+        if self.key_down_time is None:
+            self.key_down_time = time.perf_counter()
+
+    def frame_finished(self, delay, dropped=0):
+        """
+        :param delay: time left until next frame deadline, negative if frame is late
+        :param dropped: whole frame periods the loop gave up on instead of catching up
+        :return: True once per RATE_INTERVAL, when IPS and FPS were updated
+        """
+        self.frames += 1
+        if delay < 0:
+            self.late_frames += 1
+        self.dropped_frames += dropped
+        now = time.perf_counter()
+        elapsed = now - self.rate_time
+        if elapsed < RATE_INTERVAL:
+            return False
+        self.frames_per_second = (self.presented_frames - self.rate_frames) / elapsed
+        self.instructions_per_second = (self.instructions - self.rate_instructions) / elapsed
+        self.rate_time = now
+        self.rate_frames = self.presented_frames
+        self.rate_instructions = self.instructions
+        return True
+
+    def overlay_text(self):
+        latency = self.input_latencies.quantile(0.9)
+        return "{:.0f} fps  {:.0f} IPS  late {}  dropped {}  skipped {}  p90 input {}".format(
+            self.frames_per_second, self.instructions_per_second, self.late_frames, self.dropped_frames,
+            self.skipped_frames,
+            '-' if latency is None else '<{:.0f} ms'.format(latency * 1000))
+
+    def render(self):
+        """
+        Metrics in Prometheus text exposition format
+        :return: string
+        """
+        lines = list()
+        counters = (
+            ('chip8_frames_total', 'Frames emulated.', self.frames),
+            ('chip8_presented_frames_total', 'Frames drawn.', self.presented_frames),
+            ('chip8_skipped_frames_total', 'Changed frames not drawn because rendering fell behind.', self.skipped_frames),
+            ('chip8_late_frames_total', 'Frames which took longer than the frame budget.', self.late_frames),
+            ('chip8_dropped_frames_total', 'Frame periods missed while running late.', self.dropped_frames),
+            ('chip8_instructions_total', 'Instructions executed.', self.instructions),
+        )
+        for name, description, value in counters:
+            lines += ["# HELP {} {}".format(name, description), "# TYPE {} counter".format(name), "{} {}".format(name, value)]
+        gauges = (
+            ('chip8_instructions_per_second', 'Instructions executed per second.', self.instructions_per_second),
+            ('chip8_frames_per_second', 'Frames drawn per second.', self.frames_per_second),
+            ('chip8_uptime_seconds', 'Seconds since telemetry started.', time.perf_counter() - self.start_time),
+        )
+        for name, description, value in gauges:
+            lines += ["# HELP {} {}".format(name, description), "# TYPE {} gauge".format(name), "{} {}".format(name, value)]
+        for histogram in (self.frame_times, self.cpu_times, self.render_times, self.event_times, self.input_latencies):
+            lines += histogram.render()
+        return '\n'.join(lines) + '\n'
+
+    def write_file(self, path):
+        """
+        Write metrics to file atomically, for node exporter textfile collector and similar.
+        Temporary file gets a unique name in the same directory, so concurrent writers
+        do not clash and os.replace never crosses file systems.
+        :param path: output file path
+        :return: None
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        handle, temporary_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path) + '.',
+                                                  suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'w') as fh:
+                fh.write(self.render())
+            os.replace(temporary_path, path)
+        finally:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+
+
+class MetricsServer(object):
+    def __init__(self, telemetry, port, host='127.0.0.1'):
+        """
+        Serve metrics at http://host:port/metrics from a background thread.
+        Values are read without locking, so a scrape can mix values of two frames.
+        :param telemetry: Telemetry object
+        """
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != '/metrics':
+                    self.send_error(404)
+                    return
+                body = telemetry.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name='metrics', daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()